@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# Synthetic inputs for the benchmarks - shaped like what EssentialsList sees on
+# a real (and rather busy) machine, but generated so they run offline on any
+# OS.  Everything is seeded, so the same arguments always give the same files.
+#
+# Usage: python Benchmarks/fixtures.py [folder] [scale]
+import os, sys, random, binascii
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Scripts"))
+import plist
+
+EFI_GUID  = "C12A7328-F81F-11D2-BA4B-00A0C93EC93B"
+APFS_GUID = "7C3457EF-0000-11AA-AA11-00306543ECAC"
+HFS_GUID  = "48465300-0000-11AA-AA11-00306543ECAC"
+
+def _uuid(rand):
+    h = "".join(rand.choice("0123456789ABCDEF") for _ in range(32))
+    return "-".join((h[:8], h[8:12], h[12:16], h[16:20], h[20:]))
+
+def diskdump(disks = 300, partitions = 4, seed = 1):
+    # Returns a diskdump-style dict - physical GPT disks with an EFI partition,
+    # and APFS containers (every third disk) whose volumes sit on the previous
+    # disk's physical store.  About half the volumes are mounted.
+    rand   = random.Random(seed)
+    result = {"AllDisks":[],"AllDisksAndPartitions":[],"MountPointsFromDisks":["/"],"VolumesFromDisks":[]}
+    for i in range(disks):
+        whole = "disk{}".format(i)
+        container = i % 3 == 2
+        d = {
+            "DAMediaBSDName": whole,
+            "DAMediaContent": "GUID_partition_scheme" if not container else "EF57347C-0000-11AA-AA11-00306543ECAC",
+            "DAMediaSize": rand.randint(1, 4000) * 1000000000,
+            "DAMediaWhole": True,
+            "DAMediaUUID": _uuid(rand),
+            "Partitions": []
+        }
+        if container:
+            d["container"] = True
+            d["physical_stores"] = ["disk{}s2".format(i-1)]
+            result["AllDisksAndPartitions"][-1]["Partitions"][1]["container_for"] = whole
+        result["AllDisks"].append(whole)
+        for j in range(1, partitions + 1):
+            ident = "{}s{}".format(whole, j)
+            if container:
+                name, content, kind = "Volume {} {}".format(i, j), APFS_GUID, "apfs"
+            elif j == 1:
+                name, content, kind = "EFI", EFI_GUID, "msdos"
+            else:
+                name, content, kind = "Data {} {}".format(i, j), APFS_GUID if j == 2 else HFS_GUID, "hfs"
+            p = {
+                "DAMediaBSDName": ident,
+                "DAMediaContent": content,
+                "DAMediaSize": rand.randint(1, 500) * 1000000000,
+                "DAMediaUUID": _uuid(rand),
+                "DAVolumeKind": kind,
+                "DAVolumeName": name,
+                "DAVolumeUUID": _uuid(rand)
+            }
+            if rand.random() < 0.5 and j != 1:
+                p["DAVolumePath"] = "/Volumes/" + name
+                result["MountPointsFromDisks"].append(p["DAVolumePath"])
+                result["VolumesFromDisks"].append(name)
+            d["Partitions"].append(p)
+            result["AllDisks"].append(ident)
+        result["AllDisksAndPartitions"].append(d)
+    # Someone has to be the boot volume
+    for d in result["AllDisksAndPartitions"]:
+        if d.get("container"):
+            d["Partitions"][0]["DAVolumePath"] = "/"
+            break
+    return result
+
+def info_plist(i, personalities = 12):
+    # Roughly the shape of a real kext's Info.plist
+    return {
+        "BuildMachineOSBuild": "19H15",
+        "CFBundleDevelopmentRegion": "English",
+        "CFBundleExecutable": "Kext{}".format(i),
+        "CFBundleIdentifier": "com.example.driver.Kext{}".format(i),
+        "CFBundleInfoDictionaryVersion": "6.0",
+        "CFBundleName": "Kext{}".format(i),
+        "CFBundlePackageType": "KEXT",
+        "CFBundleShortVersionString": "1.{}.0".format(i % 100),
+        "CFBundleSignature": "????",
+        "CFBundleSupportedPlatforms": ["MacOSX"],
+        "CFBundleVersion": "1.{}.{}".format(i % 100, i),
+        "IOKitPersonalities": dict(
+            ("Personality{}".format(p), {
+                "CFBundleIdentifier": "com.example.driver.Kext{}".format(i),
+                "IOClass": "ExampleDriver{}".format(p),
+                "IOMatchCategory": "ExampleDriver",
+                "IOPCIMatch": " ".join("0x{:04x}8086".format(x) for x in range(p, p + 16)),
+                "IOProbeScore": 1000 + p,
+                "IOProviderClass": "IOPCIDevice",
+                "Properties": dict(("Property{}".format(x), x) for x in range(24))
+            }) for p in range(personalities)
+        ),
+        "OSBundleLibraries": {
+            "com.apple.iokit.IOPCIFamily": "1.0.0b1",
+            "com.apple.kpi.iokit": "10.0.0",
+            "com.apple.kpi.libkern": "10.0.0"
+        },
+        "OSBundleRequired": "Root"
+    }
+
+def kext_tree(folder, kexts = 2000, plugins = 3, personalities = 12):
+    # Writes kexts/Kext<i>.kext/Contents/Info.plist under folder - every fourth
+    # one binary, and every tenth with a few plugin kexts of its own, like a
+    # busy /Library/Extensions.  Returns how many Info.plists were written.
+    written = 0
+    for i in range(kexts):
+        bundle = os.path.join(folder, "Kext{}.kext".format(i))
+        bundles = [(bundle, i)]
+        if i % 10 == 0:
+            bundles.extend((os.path.join(bundle, "Contents", "PlugIns", "Plugin{}.kext".format(p)), kexts + i * plugins + p) for p in range(plugins))
+        for path, n in bundles:
+            contents = os.path.join(path, "Contents")
+            if not os.path.isdir(contents):
+                os.makedirs(contents)
+            with open(os.path.join(contents, "Info.plist"), "wb") as f:
+                plist.dump(info_plist(n, personalities), f, fmt=plist.FMT_BINARY if n % 4 == 3 else plist.FMT_XML)
+            written += 1
+    return written
+
+def config_plist(devices = 200, properties = 40, seed = 1):
+    # Returns an OpenCore-style config.plist dict with a large DeviceProperties
+    # section - lots of PciRoot paths, each with data and string properties -
+    # plus the PlatformInfo serials get_stripped_config() hides
+    rand = random.Random(seed)
+    add  = {}
+    for d in range(devices):
+        path = "PciRoot(0x0)/Pci(0x{:x},0x{:x})/Pci(0x0,0x{:x})".format(d % 32, d // 32 % 8, d // 256)
+        props = {}
+        for p in range(properties):
+            if p % 3 == 0:
+                props["device-property-{}".format(p)] = "value-{}-{}".format(d, p)
+            else:
+                props["device-property-{}".format(p)] = bytes(bytearray(rand.randint(0, 255) for _ in range(4 + p % 60)))
+        add[path] = props
+    serials = {
+        "MLB": "C02{:014d}".format(seed),
+        "ROM": b"\x11\x22\x33\x44\x55\x66",
+        "SystemSerialNumber": "C02XX{:07d}".format(seed),
+        "SystemUUID": _uuid(rand)
+    }
+    return {
+        "ACPI": {"Add": [{"Path": "SSDT-{}.aml".format(x), "Enabled": True, "Comment": ""} for x in range(40)]},
+        "DeviceProperties": {"Add": add, "Delete": dict((x, ["property"]) for x in list(add)[:20])},
+        "Kernel": {"Add": [{"BundlePath": "Kext{}.kext".format(x), "Enabled": True, "PlistPath": "Contents/Info.plist"} for x in range(60)]},
+        "PlatformInfo": {"Generic": serials, "SMBIOS": {"BoardSerialNumber": serials["MLB"], "SmUUID": serials["SystemUUID"]}},
+        "SMBIOS": {"CustomUUID": _uuid(rand)}
+    }
+
+def boot_log(lines = 400):
+    # A Clover-ish boot log - as text
+    log = ["0:100  0:000  Now is 18.10.2026,  12:00:00 (GMT)", "0:100  0:000  Starting Clover revision: 5150"]
+    log.extend("0:{:03d}  0:000  Loading driver {} status=Success".format(x % 1000, x) for x in range(lines))
+    log.append("0:200  0:000  SelfDevicePath=PciRoot(0x0)\\Pci(0x17,0x0)\\Sata(0x0,0xFFFF,0x0)\\HD(1,GPT,ABCD1234-0000-4000-8000-0123456789AB,0x28,0x64000)")
+    return "\n".join(log) + "\n"
+
+def ioreg_lines(size, seed = 1):
+    # Yields the lines of a fake "ioreg -l -w0" dump until roughly size bytes
+    # have gone by - a platform expert node carrying the boot-log, then PCI
+    # bridges full of devices with the usual mix of property types
+    rand = random.Random(seed)
+    ident = [0x100000100]
+    def node(prefix, name, cls):
+        ident[0] += 1
+        return "{}+-o {}  <class {}, id 0x{:x}, registered, matched, active, busy 0 (0 ms), retain {}>".format(prefix, name, cls, ident[0], rand.randint(6, 40))
+    def props(prefix, values):
+        out = [prefix + "{"]
+        out.extend('{}  "{}" = {}'.format(prefix, k, v) for k, v in values)
+        out.extend((prefix + "}", prefix))
+        return out
+    log   = binascii.hexlify(boot_log().encode("utf-8")).decode("ascii")
+    lines = [node("", "Root", "IORegistryEntry")]
+    lines.extend(props("  | ", (("IOKitBuildVersion", '"Darwin Kernel Version 19.6.0"'), ("IOConsoleLocked", "No"))))
+    lines.append(node("  ", "MacBookPro15,1", "IOPlatformExpertDevice"))
+    lines.extend(props("    | ", (
+        ("compatible", '<"MacBookPro15,1">'),
+        ("IOPlatformSerialNumber", '"C02XXXXXXXXX"'),
+        ("IOPlatformUUID", '"AAAA1111-BB22-CC33-DD44-EEEEEE555555"'),
+        ("boot-log", "<{}>".format(log))
+    )))
+    total = 0
+    for line in lines:
+        total += len(line) + 1
+        yield line
+    bridge = 0
+    while total < size:
+        lines = [node("    ", "PCI{}@{:x}".format(bridge, bridge), "IOPCIBridge")]
+        lines.extend(props("    | ", (("IOName", '"pci-bridge"'), ("bus-range", "<00000000{:02x}000000>".format(bridge % 256)))))
+        for d in range(32):
+            lines.append(node("    | ", "DEV{}@{:x}".format(d, d), "IOPCIDevice"))
+            lines.extend(props("    | | ", (
+                ("IOName", '"pci8086,{:04x}"'.format(rand.randint(0, 0xffff))),
+                ("vendor-id", "<86800000>"),
+                ("device-id", "<{:08x}>".format(rand.randint(0, 0xffffffff))),
+                ("reg", "<{}>".format("".join("{:02x}".format(rand.randint(0, 255)) for _ in range(80)))),
+                ("IOPowerManagement", '{"CurrentPowerState"=2,"CapabilityFlags"=258,"MaxPowerState"=2}'),
+                ("IOInterruptSpecifiers", "(<{:08x}00000000>)".format(d)),
+                ("built-in", "<00>"),
+                ("IOPCIExpressLinkStatus", str(rand.randint(0, 0x4000)))
+            )))
+        for line in lines:
+            total += len(line) + 1
+            yield line
+        bridge += 1
+
+def write_ioreg(path, size, seed = 1):
+    # Streams ioreg_lines() to path - without ever holding all of it in memory
+    with open(path, "w") as f:
+        for line in ioreg_lines(size, seed):
+            f.write(line + "\n")
+    return path
+
+def kextcache_lines(kexts = 500, lines = 100000, seed = 1):
+    # Yields kextcache -i output - the same few kexts complaining over and over,
+    # with the odd message that doesn't name one
+    rand = random.Random(seed)
+    messages = (
+        'Kext rejected due to system policy: <OSKext 0x7f8{:x} [0x7fff8]> {{ URL = "file:///Library/Extensions/Kext{}.kext/", ID = "com.example.driver.Kext{}" }}',
+        'Kext with invalid signatured (-67062) allowed: <OSKext 0x7f8{:x} [0x7fff8]> {{ URL = "file:///Library/Extensions/Kext{}.kext/", ID = "com.example.driver.Kext{}" }}',
+        'Authenticating extension failed: <OSKext 0x7f8{:x} [0x7fff8]> {{ URL = "file:///Library/Extensions/Kext{}.kext/", ID = "com.example.driver.Kext{}" }}',
+        'Kext com.example.driver.Kext{1} - dependency resolution failed: <OSKext 0x7f8{0:x}> {{ URL = "file:///Library/Extensions/Kext{1}.kext/", ID = "com.example.driver.Kext{2}" }}',
+        'Untrusted kext is not signed: <OSKext 0x7f8{:x} [0x7fff8]> {{ URL = "file:///Library/Extensions/Kext{}.kext/", ID = "com.example.driver.Kext{}" }}'
+    )
+    for x in range(lines):
+        if x % 50 == 0:
+            yield "KernelCache ID: {:032X}".format(rand.getrandbits(128))
+            continue
+        if x % 97 == 0:
+            yield "Invalid signature found while building prelinked kernel"
+            continue
+        k = rand.randint(0, kexts - 1)
+        yield rand.choice(messages).format(rand.getrandbits(32), k, k)
+
+def build(folder, scale = 1.0):
+    # Writes a full set of fixtures to folder, sized by scale - skipping any
+    # that are already there.  Returns a dict of name -> path.
+    scale = max(scale, 0.01)
+    paths = {
+        "diskdump_xml":    os.path.join(folder, "diskdump-{}.plist".format(scale)),
+        "diskdump_binary": os.path.join(folder, "diskdump-{}.bin.plist".format(scale)),
+        "config":          os.path.join(folder, "config-{}.plist".format(scale)),
+        "ioreg":           os.path.join(folder, "ioreg-{}.txt".format(scale)),
+        "kexts":           os.path.join(folder, "kexts-{}".format(scale)),
+        "kextcache":       os.path.join(folder, "kextcache-{}.txt".format(scale))
+    }
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    if not os.path.exists(paths["diskdump_binary"]):
+        disks = diskdump(int(300 * scale))
+        for name, fmt in (("diskdump_xml", plist.FMT_XML), ("diskdump_binary", plist.FMT_BINARY)):
+            with open(paths[name], "wb") as f:
+                plist.dump(disks, f, fmt=fmt)
+    if not os.path.exists(paths["config"]):
+        with open(paths["config"], "wb") as f:
+            plist.dump(config_plist(int(200 * scale)), f)
+    if not os.path.exists(paths["ioreg"]):
+        write_ioreg(paths["ioreg"] + ".tmp", int(64 * 1024 * 1024 * scale))
+        os.rename(paths["ioreg"] + ".tmp", paths["ioreg"])
+    if not os.path.exists(paths["kexts"]):
+        kext_tree(paths["kexts"] + ".tmp", int(2000 * scale))
+        os.rename(paths["kexts"] + ".tmp", paths["kexts"])
+    if not os.path.exists(paths["kextcache"]):
+        with open(paths["kextcache"], "w") as f:
+            for line in kextcache_lines(int(500 * scale), int(100000 * scale)):
+                f.write(line + "\n")
+    return paths
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else "fixtures"
+    scale  = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    for name, path in sorted(build(folder, scale).items()):
+        print(" - {:<16} {}".format(name, path))
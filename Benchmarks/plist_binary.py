@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Compares plist's buffer-based binary parser against the standard library's
+# seek-and-read one on a large binary plist - roughly an ioreg/kext dump's
+# worth of nested dicts, ints, strings and data.  Checks first that corrupted
+# files are still reported as InvalidFileException.
+#
+# Usage: python Benchmarks/plist_binary.py [objects] [runs]
+import os, sys, time, plistlib, tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Scripts"))
+import plist
+
+def entry(i):
+    # 12 objects per entry - counting its keys
+    return {
+        "IOClass": "Device{}".format(i % 500),
+        "IOProbeScore": i,
+        "IOPCIMatch": "0x{:04x}8086".format(i % 0x10000),
+        "reg": b"\x00\x10" * (8 + i % 24),
+        "Enabled": i % 2 == 0
+    }
+
+def build(path, objects):
+    value = {"Entries": [entry(i) for i in range(max(1, objects // 12))]}
+    with open(path, "wb") as f:
+        plist.dump(value, f, fmt=plist.FMT_BINARY)
+    return value
+
+def time_it(method, path, runs):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        result = method(path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def stdlib_load(path):
+    with open(path, "rb") as f:
+        return plistlib.load(f)
+
+def plist_load(path):
+    with open(path, "rb") as f:
+        return plist.load(f)
+
+def plist_loads(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return plist.loads(data)
+
+def plist_get_key(path):
+    with open(path, "rb") as f:
+        return {"Entries": plist.get_key(f, "Entries")}
+
+def check_corrupt(path):
+    # Flips each byte of a small binary plist in turn - anything that can't be
+    # read has to raise InvalidFileException, whatever state the buffer's in
+    value = {"Entries": [entry(i) for i in range(3)]}
+    with open(path, "wb") as f:
+        plist.dump(value, f, fmt=plist.FMT_BINARY)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    # Past the "bplist00" magic - without it, it's not a binary plist at all
+    for i in range(8, len(data)):
+        data[i] ^= 0xFF
+        with open(path, "wb") as f:
+            f.write(data)
+        data[i] ^= 0xFF
+        for method in (plist_load, plist_get_key):
+            try:
+                method(path)
+            except plist.InvalidFileException:
+                pass
+            except Exception as e:
+                print("Flipping byte {} raised {!r} from {}!".format(i, e, method.__name__))
+                sys.exit(1)
+    print("Corrupted files raise InvalidFileException - OK")
+
+def main():
+    objects = int(sys.argv[1]) if len(sys.argv) > 1 else 240000
+    runs    = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    fd, path = tempfile.mkstemp(suffix=".plist")
+    os.close(fd)
+    try:
+        check_corrupt(path)
+        value = build(path, objects)
+        print("Parsing a {:,} byte binary plist of ~{:,} objects, best of {}:".format(os.path.getsize(path), objects, runs))
+        results = {}
+        for name, method in (("stdlib", stdlib_load), ("load", plist_load), ("loads", plist_loads), ("get_key", plist_get_key)):
+            elapsed, result = time_it(method, path, runs)
+            if result != value:
+                print("{} returned the wrong value!".format(name))
+                sys.exit(1)
+            results[name] = elapsed
+            print(" - {:<8} {:>8.3f}s  ({:.2f} us/object)".format(name, elapsed, elapsed / objects * 1000000))
+        print("Speedup over stdlib: {:.1f}x".format(results["stdlib"] / results["load"]))
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main()
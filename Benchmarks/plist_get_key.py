@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Compares plist.get_key() against a full plist.load() for pulling the
+# CFBundleVersion out of a synthetic corpus of kext Info.plists - a mix of
+# XML and binary, each with a sizeable IOKitPersonalities dict.
+#
+# Usage: python Benchmarks/plist_get_key.py [count] [runs]
+import os, sys, time, shutil, tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Scripts"))
+import plist
+from fixtures import info_plist
+
+def build_corpus(folder, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, "Kext{}.kext".format(i), "Contents")
+        os.makedirs(path)
+        path = os.path.join(path, "Info.plist")
+        # Every 4th one is binary
+        fmt = plist.FMT_BINARY if i % 4 == 3 else plist.FMT_XML
+        with open(path, "wb") as f:
+            plist.dump(info_plist(i), f, fmt=fmt)
+        paths.append(path)
+    return paths
+
+def full_load(path):
+    with open(path, "rb") as f:
+        return plist.load(f).get("CFBundleVersion")
+
+def get_key(path):
+    with open(path, "rb") as f:
+        return plist.get_key(f, "CFBundleVersion")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    runs  = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    temp  = tempfile.mkdtemp()
+    try:
+        print("Building {:,} Info.plists...".format(count))
+        paths = build_corpus(temp, count)
+        results = {}
+        for name, method in (("load", full_load), ("get_key", get_key)):
+            best = None
+            for _ in range(runs):
+                start = time.time()
+                versions = [method(p) for p in paths]
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, versions)
+            print(" - {:<8} {:>8.3f}s  ({:.1f} us/plist)".format(name, best, best / count * 1000000))
+        if results["load"][1] != results["get_key"][1]:
+            print("Mismatched versions!")
+            sys.exit(1)
+        print("Speedup: {:.1f}x".format(results["load"][0] / results["get_key"][0]))
+    finally:
+        shutil.rmtree(temp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Times how long EssentialsList takes to get to its first prompt - importing
+# the script (and the Scripts package), then constructing Essentials - each
+# run in a fresh interpreter so nothing is already imported or cached.
+#
+# Exits with 1 if the median total is over the budget, or more than the
+# tolerance over a saved baseline.
+#
+# Usage: python Benchmarks/startup.py [--runs N] [--budget SECONDS]
+#                                     [--baseline FILE] [--save] [--tolerance X]
+import os, sys, json, subprocess, argparse
+
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Run in the child interpreter - prints the timings as json
+child = (
+    "import sys, time, json\n"
+    "start = time.time()\n"
+    "sys.path.insert(0, {root!r})\n"
+    "import EssentialsList\n"
+    "imported = time.time()\n"
+    "e = EssentialsList.Essentials()\n"
+    "built = time.time()\n"
+    "print(json.dumps({{'import':imported-start,'construct':built-imported,'total':built-start}}))\n"
+).format(root=root)
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid-1] + values[mid]) / 2.0
+
+def time_startup(runs):
+    results = {"import":[],"construct":[],"total":[]}
+    for _ in range(runs):
+        # Don't let a cached .pyc in one run and not the next skew things
+        p = subprocess.Popen([sys.executable, "-c", child], cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        o, e = p.communicate()
+        if p.returncode != 0:
+            raise RuntimeError("Startup failed:\n{}".format(e.decode("utf-8","ignore")))
+        timings = json.loads(o.decode("utf-8").strip().split("\n")[-1])
+        for key in results:
+            results[key].append(timings[key])
+    return dict((key, median(values)) for key, values in results.items())
+
+def main():
+    parser = argparse.ArgumentParser(description="Time EssentialsList's startup")
+    parser.add_argument("--runs", type=int, default=9, help="fresh interpreters to time (default 9)")
+    parser.add_argument("--budget", type=float, default=0.5, help="max median seconds to the first prompt (default 0.5)")
+    parser.add_argument("--baseline", help="json file of a previous run to compare against")
+    parser.add_argument("--save", action="store_true", help="save this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed ratio over the baseline (default 1.25)")
+    args = parser.parse_args()
+
+    results = time_startup(args.runs)
+    print("Startup, median of {} fresh interpreters:".format(args.runs))
+    for key in ("import","construct","total"):
+        print(" - {:<9} {:>8.1f} ms".format(key, results[key] * 1000))
+
+    if args.baseline and args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Saved baseline to {}".format(args.baseline))
+        return 0
+
+    failed = False
+    if results["total"] > args.budget:
+        print("FAIL: {:.1f} ms is over the {:.1f} ms budget".format(results["total"] * 1000, args.budget * 1000))
+        failed = True
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        limit = baseline["total"] * args.tolerance
+        print("Baseline: {:.1f} ms (limit {:.1f} ms)".format(baseline["total"] * 1000, limit * 1000))
+        if results["total"] > limit:
+            print("FAIL: {:.2f}x slower than the baseline".format(results["total"] / baseline["total"]))
+            failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
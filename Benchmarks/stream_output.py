@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Compares the throughput of Run's selector-based streaming against the
+# threaded char-at-a-time reader, using a local python process as a
+# stand-in for a chatty command like kextcache.
+#
+# Usage: python Benchmarks/stream_output.py [megabytes] [runs]
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Scripts"))
+import run
+
+def stand_in(megabytes):
+    # Prints lines that look a bit like kextcache warnings to stdout, with
+    # every 10th one on stderr
+    script = (
+        "import sys\n"
+        "line = 'KextCache: file:///Library/Extensions/Some.kext/ is not signed - {}\\n'\n"
+        "total = 0\n"
+        "i = 0\n"
+        "while total < {}:\n"
+        "    l = line.format(i)\n"
+        "    (sys.stderr if i % 10 == 0 else sys.stdout).write(l)\n"
+        "    total += len(l)\n"
+        "    i += 1\n"
+    ).format("{}", int(megabytes * 1024 * 1024))
+    return [sys.executable, "-c", script]
+
+def time_method(method, comm, runs):
+    # Silence the tee to the terminal while we time things
+    best = None
+    with open(os.devnull, "w") as null:
+        for _ in range(runs):
+            out, err = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = null
+            try:
+                start = time.time()
+                o, e, code = method(comm)
+                elapsed = time.time() - start
+            finally:
+                sys.stdout, sys.stderr = out, err
+            best = elapsed if best is None else min(best, elapsed)
+    return best, len(o) + len(e)
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    runs      = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    r = run.Run()
+    comm = stand_in(megabytes)
+    print("Streaming {} MB from a stand-in command, best of {}:".format(megabytes, runs))
+    results = {}
+    for name, method in (("threaded", r._stream_threaded), ("selector", r._stream_select)):
+        elapsed, size = time_method(method, comm, runs)
+        results[name] = elapsed
+        print(" - {:<8} {:>8.3f}s  {:>8.2f} MB/s  ({:,} chars)".format(name, elapsed, size / 1024.0 / 1024.0 / elapsed, size))
+    print("Speedup: {:.1f}x".format(results["threaded"] / results["selector"]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# Times the parsing and post-processing EssentialsList does on big inputs -
+# plists, diskdump lookups, config.plist redaction, ioreg/bdmesg parsing,
+# kextcache output, and kext version scanning - against the synthetic
+# fixtures in fixtures.py, so it runs offline on any OS.
+#
+# Each benchmark reports the best and median of its runs.  Results can be
+# written out as json, saved as a baseline, or compared against one - exiting
+# with 1 if any benchmark's best is more than the tolerance over it.
+#
+# Usage: python Benchmarks/suite.py [--scale X] [--runs N] [--only NAME ...]
+#                                   [--fixtures FOLDER] [--output FILE]
+#                                   [--baseline FILE] [--save] [--tolerance X]
+import os, sys, json, time, shutil, tempfile, argparse, platform
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root)
+import fixtures
+import EssentialsList
+from Scripts import bdmesg, disk, inventory, ioregistry, kextlog, plist
+
+# perf_counter is py3 only
+timer = getattr(time, "perf_counter", time.time)
+
+# Made the first time a benchmark needs them - so --only skips the setup
+_helpers = {}
+
+def helper(name):
+    if not name in _helpers:
+        if name == "disk":
+            _helpers[name] = disk.Disk()
+        else:
+            _helpers[name] = EssentialsList.Essentials(kext_version_cache=False)
+    return _helpers[name]
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid-1] + values[mid]) / 2.0
+
+def bench_plist_xml(paths):
+    with open(paths["diskdump_xml"], "rb") as f:
+        return len(plist.load(f)["AllDisks"])
+
+def bench_plist_binary(paths):
+    with open(paths["diskdump_binary"], "rb") as f:
+        return len(plist.load(f)["AllDisks"])
+
+def bench_plist_get_keys(paths):
+    with open(paths["config"], "rb") as f:
+        return len(plist.get_keys(f, ("PlatformInfo","SMBIOS"))["PlatformInfo"])
+
+def bench_disk_lookups(paths):
+    d = helper("disk")
+    with open(paths["diskdump_binary"], "rb") as f:
+        disks = plist.load(f)
+    # A new dict, so the lookup tables are rebuilt as part of the run
+    d.disks = disks
+    found = 0
+    for whole in disks["AllDisksAndPartitions"]:
+        for entry in [whole] + whole.get("Partitions",[]):
+            for key in ("DAMediaBSDName","DAVolumeName","DAVolumeUUID","DAMediaUUID","DAVolumePath"):
+                if key in entry and d.get_identifier(entry[key]):
+                    found += 1
+        d.get_efi(whole["DAMediaBSDName"])
+    d.get_mounted_volume_dicts()
+    d.get_disks_and_partitions_dict()
+    return found
+
+def bench_config_redact(paths):
+    opened, raw = helper("essentials").get_stripped_config(paths["config"], True)
+    return len(raw)
+
+def bench_ioreg_parse(paths):
+    # Streams the dump from disk - like a plane being captured
+    with open(paths["ioreg"], "rb") as f:
+        return len(ioregistry.parse(f, "IODeviceTree", max_value=4096))
+
+def bench_bdmesg(paths):
+    # bdmesg works from the in-memory snapshot ioreg() would have taken
+    with open(paths["ioreg"]) as f:
+        text = f.read()
+    bdmesg.reset()
+    bdmesg._snapshots["IODeviceTree"] = text
+    log = bdmesg._bdmesg("IODeviceTree")
+    bdmesg.reset()
+    if not "SelfDevicePath=" in log:
+        raise RuntimeError("bdmesg didn't find the boot-log")
+    return len(log)
+
+def bench_kextcache(paths):
+    log = kextlog.KextLog()
+    with open(paths["kextcache"], "rb") as f:
+        for line in f:
+            log.line(line.rstrip(b"\n"))
+    log.summary()
+    return len(log.paths())
+
+def bench_kext_versions(paths):
+    # Walks the tree the way the kext folders are listed, reading each version
+    e = helper("essentials")
+    inv = inventory.Inventory(paths["kexts"])
+    stack = [""]
+    count = 0
+    while stack:
+        rel = stack.pop()
+        for parent, entry in inv.bundles(rel):
+            if e.get_kext_version(entry.path) != "Unknown":
+                count += 1
+            stack.append(os.path.relpath(os.path.join(entry.path, "Contents", "PlugIns"), paths["kexts"]))
+    return count
+
+BENCHMARKS = (
+    ("plist.load_xml",     bench_plist_xml),
+    ("plist.load_binary",  bench_plist_binary),
+    ("plist.get_keys",     bench_plist_get_keys),
+    ("disk.lookups",       bench_disk_lookups),
+    ("config.redact",      bench_config_redact),
+    ("ioreg.parse",        bench_ioreg_parse),
+    ("bdmesg.boot_log",    bench_bdmesg),
+    ("kextcache.summary",  bench_kextcache),
+    ("kexts.versions",     bench_kext_versions)
+)
+
+def run_benchmarks(paths, runs, only = None):
+    results = {}
+    for name, method in BENCHMARKS:
+        if only and not any(name == x or name.startswith(x + ".") for x in only):
+            continue
+        times = []
+        for _ in range(runs):
+            start = timer()
+            size = method(paths)
+            times.append(timer() - start)
+        results[name] = {"best":min(times),"median":median(times),"runs":runs,"size":size}
+        print(" - {:<18} {:>9.3f}s best  {:>9.3f}s median  ({:,} items)".format(name, min(times), median(times), size))
+    return results
+
+def compare(results, baseline, tolerance):
+    # Returns the names of any benchmarks over the tolerance
+    failed = []
+    if baseline.get("scale") != results["scale"]:
+        print("Baseline was run at scale {} - not comparing".format(baseline.get("scale")))
+        return failed
+    print("Against the baseline (limit {:.2f}x):".format(tolerance))
+    for name, result in sorted(results["benchmarks"].items()):
+        if not name in baseline.get("benchmarks",{}):
+            print(" - {:<18} new".format(name))
+            continue
+        ratio = result["best"] / max(baseline["benchmarks"][name]["best"], 1e-9)
+        print(" - {:<18} {:>6.2f}x{}".format(name, ratio, "  FAIL" if ratio > tolerance else ""))
+        if ratio > tolerance:
+            failed.append(name)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EssentialsList's parsers against synthetic fixtures")
+    parser.add_argument("--scale", type=float, default=1.0, help="fixture size multiplier - 1 is ~300 disks, a 64 MB ioreg dump, and 2,000 kexts (default 1)")
+    parser.add_argument("--runs", type=int, default=3, help="times to run each benchmark (default 3)")
+    parser.add_argument("--only", nargs="+", help="only run these benchmarks - or groups, like plist")
+    parser.add_argument("--fixtures", help="folder to build fixtures in and reuse between runs (default: a temp folder)")
+    parser.add_argument("--output", help="json file to write the results to")
+    parser.add_argument("--baseline", help="json file of a previous run to compare against")
+    parser.add_argument("--save", action="store_true", help="save this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed ratio over the baseline (default 1.25)")
+    args = parser.parse_args()
+
+    folder = args.fixtures or tempfile.mkdtemp(prefix="essentials-bench-")
+    try:
+        print("Building fixtures at scale {} in {}...".format(args.scale, folder))
+        start = timer()
+        paths = fixtures.build(folder, args.scale)
+        print("Ready in {:.1f}s - best of {} runs:".format(timer() - start, args.runs))
+        results = {
+            "scale": args.scale,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "benchmarks": run_benchmarks(paths, args.runs, args.only)
+        }
+    finally:
+        if not args.fixtures:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Wrote results to {}".format(args.output))
+    if args.baseline and args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Saved baseline to {}".format(args.baseline))
+        return 0
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            failed = compare(results, json.load(f), args.tolerance)
+        if failed:
+            print("FAIL: {} slower than the baseline".format(", ".join(failed)))
+            return 1
+    print("OK")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from Scripts import *
-import os, sys, tempfile, datetime, shutil, time, plistlib, json
+import os, sys, tempfile, datetime, shutil, time, plistlib, json, threading
 
 try:
     basestring  # Python 2
@@ -51,30 +51,68 @@ class Essentials:
         self.cache      = kwargs.get("kextcache", True)
         self.kfold      = kwargs.get("kextfolders", True)
         self.zip        = kwargs.get("zip", True)
+        # Number of collectors allowed to run at once
+        self.workers    = kwargs.get("workers", 4)
+        # IORegistry planes to dump, and how many to capture at once
+        self.ioreg_planes  = kwargs.get("ioreg_planes", ["IOService","CoreCapture","IO80211Plane","IOACPIPlane","IODeviceTree","IOPower","IOUSB"])
+        self.ioreg_workers = kwargs.get("ioreg_workers", 4)
+        # Files copied into the output at once - and whether identical files
+        # are stored just once (hardlinked in a folder).  Zips only store them
+        # once (as symlinks) with zip_links - which Windows and most zip
+        # viewers can't open.
+        self.copy_workers  = kwargs.get("copy_workers", 4)
+        self.dedupe_files  = kwargs.get("dedupe_files", True)
+        self.zip_links     = kwargs.get("zip_links", False)
+        # Seconds a single command, the kextcache rebuild, and a whole collector
+        # can take before we stop them and move on with what we have
+        self.r.timeout  = kwargs.get("command_timeout", 120)
+        self.kc_timeout = kwargs.get("kextcache_timeout", 600)
+        self.c_timeout  = kwargs.get("collector_timeout", 900)
+        # Remember kext versions between runs
+        self.kv         = versioncache.VersionCache() if kwargs.get("kext_version_cache", True) else None
+        # Bootloader versions are cached by content - and only saved between
+        # runs if efi_version_cache is enabled
+        self.efi_scan   = efiscan.EfiScan()
+        self.efi_cache  = kwargs.get("efi_version_cache", True)
         # Check for forced functions
         self.force_ssdt = kwargs.get("force_ssdt", False)
         self.force_dbg  = kwargs.get("force_debug", False)
         self.force_pre  = kwargs.get("force_preboot", False)
+        # Replay the commands (and files) captured in a bundle instead of
+        # touching the system - optionally taking as long as they did - or
+        # record this run into one
+        if kwargs.get("replay"):
+            run.set_backend(replay.Player(kwargs["replay"], timing=kwargs.get("replay_timing", False)))
+        elif kwargs.get("record"):
+            run.set_backend(replay.Recorder(kwargs["record"]))
         
-        # Get the tools we need
-        self.patchmatic = self.get_binary("patchmatic")
+        # Tools we need are looked up the first time they're used
+        self.binaries   = {}
+        self.binaries_lock = threading.Lock()
 
         # Set placeholders for serial and uuid
         self.serial     = ""
         self.smuuid     = ""
         return
 
-    def write_text(self, text, filepath):
-        # Helper method to write binary text to file on py3, but
-        # leave the str/unicode values alone on py2
-        if sys.version_info >= (3,0) and isinstance(text, str):
-            text = text.encode("utf-8","ignore")
-        with open(filepath, "wb") as f:
-            f.write(text)
-        
+    def __getattr__(self, name):
+        # Resolves self.patchmatic on first use - so we don't shell out to
+        # which before we even know if we need it
+        if name == "patchmatic":
+            return self.get_binary("patchmatic")
+        raise AttributeError(name)
+
     def get_binary(self, name):
+        # Returns the cached path to the passed binary - or None if we couldn't
+        # find it - only looking for it the first time
+        with self.binaries_lock:
+            if not name in self.binaries:
+                self.binaries[name] = self._find_binary(name)
+            return self.binaries[name]
+
+    def _find_binary(self, name):
         # Check the system, and local Scripts dir for the passed binary
-        found = self.r.run({"args":["which", name]})[0].split("\n")[0].split("\r")[0]
+        found = self.r.run({"args":["which", name], "cache":True})[0].split("\n")[0].split("\r")[0]
         if len(found):
             # Found it on the system
             return found
@@ -94,10 +132,26 @@ class Essentials:
         if "" in [ self.serial, self.smuuid ]:
             # We don't have them - get them
             print("Locating serial for obfuscation...")
-            hw = self.r.run({"args":["system_profiler", "SPHardwareDataType"]})[0].strip()
+            hw = self.r.run({"args":["system_profiler", "SPHardwareDataType"], "cache":True})[0].strip()
             self.serial = self.get_split(hw, 'Serial Number (system): ', '\n', "")
             self.smuuid = self.get_split(hw, 'Hardware UUID: ', '\n', "")
 
+    def check_serial(self):
+        # Gathers the serial and UUID - and only leaves redaction on
+        # if we got both
+        self.get_serial()
+        self.h_serial = False if "" in [ self.serial, self.smuuid ] else True
+
+    def get_redact(self):
+        # Returns a Redact object that masks the serial and UUID - or that
+        # passes everything through if we're not hiding them
+        if not self.h_serial:
+            return redact.Redact()
+        return redact.Redact({
+            self.serial: "0"*len(self.serial),
+            self.smuuid: "-".join([ "0"*len(x) for x in self.smuuid.split("-") ])
+        })
+
     def get_split(self, text, start, end, default=None):
         try:
             return text.split(start)[1].split(end)[0]
@@ -172,6 +226,9 @@ class Essentials:
         return self.d.get_efi(iden)
 
     def main(self):
+        # bdmesg's ioreg snapshots (the first is taken before the collectors
+        # start, to find the boot EFI) get the same command timeout
+        bdmesg.set_runner(self.r)
         # Check for forced logs/files and get confirmation:
         if True in [ self.force_ssdt, self.force_dbg, self.force_pre ]:
             # We have at least one forced log - let's throw up the prompt
@@ -195,21 +252,25 @@ class Essentials:
                 elif menu.lower()[:1] == "n":
                     self.u.custom_quit()
         
-        boot_drive   = self.d.get_identifier("/")
+        boot_drive   = None
         clover_drive = None
-        if self.auto_efi:
-            # Auto-get the Boot Manager location
-            efi_uuid = bdmesg.get_bootloader_uuid()
-            if efi_uuid:
-                # We were able to parse the UUID
-                clover_drive = self.d.get_identifier(efi_uuid)
-        if not clover_drive:
-            # Either we don't auto-get it, or we couldn't find it
-            clover_drive  = self.get_efi()
-        if clover_drive == boot_drive:
-            # They're the same - skip the second approach
-            clover_drive = None
-        efi_mount  = False
+        efi_mount    = False
+        if self.efi:
+            # Only go looking for the EFI if we're collecting from it - so runs
+            # that skip it never have to enumerate the disks
+            boot_drive = self.d.get_identifier("/")
+            if self.auto_efi:
+                # Auto-get the Boot Manager location
+                efi_uuid = bdmesg.get_bootloader_uuid()
+                if efi_uuid:
+                    # We were able to parse the UUID
+                    clover_drive = self.d.get_identifier(efi_uuid)
+            if not clover_drive:
+                # Either we don't auto-get it, or we couldn't find it
+                clover_drive  = self.get_efi()
+            if clover_drive == boot_drive:
+                # They're the same - skip the second approach
+                clover_drive = None
         # This will iterate through a number of processes to gather info
         # we can use for troubleshooting
 
@@ -219,7 +280,7 @@ class Essentials:
         # Now we have our folder and can run our tests
         if clover_drive:
             # Save the EFI mount state
-            self.d.update()
+            self.d.refresh(clover_drive)
             efi_mount = self.d.is_mounted(clover_drive)
             # Mount the EFI partition
             self.d.mount_partition(clover_drive)
@@ -229,30 +290,27 @@ class Essentials:
                 print("EFI failed to mount - skipping...")
             else:
                 efi_path = os.path.join(efi_mount_point, "EFI", "CLOVER")
-                if os.path.exists(efi_path):
+                if os.path.exists(run.rebase(efi_path)):
                     print("Got Clover install at {} ({})".format(efi_path, clover_drive))
                     path_list.append({ "disk" : clover_drive, "path" : efi_path })
                 efi_path = os.path.join(efi_mount_point, "EFI", "OC")
-                if os.path.exists(efi_path):
+                if os.path.exists(run.rebase(efi_path)):
                     print("Got OC install at {} ({})".format(efi_path, clover_drive))
                     path_list.append({ "disk" : clover_drive, "path" : efi_path })
-        # Check for Clover locally
-        if os.path.exists("/EFI/CLOVER"):
-            print("Got Legacy Clover install at /EFI/CLOVER ({})".format(boot_drive))
-            path_list.append({ "disk" : boot_drive, "path" : "/EFI/CLOVER" })
-        # Check for OC locally
-        if os.path.exists("/EFI/OC"):
-            print("Got Legacy OC install at /EFI/OC ({})".format(boot_drive))
-            path_list.append({ "disk" : boot_drive, "path" : "/EFI/OC" })
+        if self.efi:
+            # Check for Clover locally
+            if os.path.exists(run.rebase("/EFI/CLOVER")):
+                print("Got Legacy Clover install at /EFI/CLOVER ({})".format(boot_drive))
+                path_list.append({ "disk" : boot_drive, "path" : "/EFI/CLOVER" })
+            # Check for OC locally
+            if os.path.exists(run.rebase("/EFI/OC")):
+                print("Got Legacy OC install at /EFI/OC ({})".format(boot_drive))
+                path_list.append({ "disk" : boot_drive, "path" : "/EFI/OC" })
         
-        # First we create a temp directory into which we'll work
-        temp = tempfile.mkdtemp()
-        # Now we make a time-stamped name for that
+        # Make a time-stamped name for our output
         folder_name = "EssentialsList-{:%Y-%m-%d %H.%M.%S}".format(datetime.datetime.now())
-        folder = os.path.join(temp, folder_name)
-        os.mkdir(folder)
 
-        if not len(path_list):
+        if self.efi and not len(path_list):
             if clover_drive and not efi_mount:
                 print("Unmounting EFI partition...")
                 self.d.unmount_partition(clover_drive)
@@ -261,87 +319,156 @@ class Essentials:
 
         # print(" ")
 
+        # Collectors write straight into the zip (or folder) on the Desktop
+        # as they finish - there's no staging folder
+        desktop = os.path.expanduser("~/Desktop")
+        out = None
         try:
-            # Gather serial info if needed
+            if self.zip:
+                out = archive.Archive(os.path.join(desktop, folder_name+".zip"), folder_name, dedupe=self.dedupe_files and self.zip_links, copy_workers=self.copy_workers)
+            else:
+                out = archive.Folder(os.path.join(desktop, folder_name), dedupe=self.dedupe_files, copy_workers=self.copy_workers)
+            # Build our collectors - each one declares the collectors it needs
+            # to finish first, and the rest are free to run alongside each other
+            tasks = scheduler.Scheduler(self.workers, self.c_timeout)
+            needs_serial = []
             if self.h_serial:
-                self.get_serial()
-                self.h_serial = False if "" in [ self.serial, self.smuuid ] else True
-            # Run all the processes needed, and gather the info
-            over_text = ""
+                # Gather serial info if needed
+                tasks.add("serial", self.check_serial)
+                needs_serial = ["serial"]
             if self.efi:
-                over_text = self.process_efi(path_list, folder)
+                tasks.add("efi", self.process_efi, args=(path_list, out), depends=needs_serial)
             if self.overview:
-                self.process_overview(folder, over_text)
+                tasks.add(
+                    "overview",
+                    lambda: self.process_overview(out, tasks.result("efi", "")),
+                    depends=needs_serial+(["efi"] if self.efi else [])
+                )
             if self.disks:
-                self.process_disks(folder)
-                self.process_mount_points(folder)
+                tasks.add("disks", self.process_disks, args=(out,))
+                tasks.add("mount_points", self.process_mount_points, args=(out,))
             if self.nvram:
-                self.process_nvram(folder)
+                tasks.add("nvram", self.process_nvram, args=(out,))
             if self.bdmesg:
-                self.process_bdmesg(folder)
+                tasks.add("bdmesg", self.process_bdmesg, args=(out,))
             if self.ioreg:
-                self.process_ioreg(folder)
+                tasks.add("ioreg", self.process_ioreg, args=(out,), depends=needs_serial)
             if self.sysctl:
-                self.process_sysctl(folder)
+                tasks.add("sysctl", self.process_sysctl, args=(out,))
             if self.get_patch:
-                self.process_patchmatic(folder)
+                tasks.add("patchmatic", self.process_patchmatic, args=(out,))
             if self.get_pmset:
-                self.process_pmset(folder)
+                tasks.add("pmset", self.process_pmset, args=(out,))
             if self.kstat:
-                self.process_kextstat(folder)
+                tasks.add("kextstat", self.process_kextstat, args=(out,))
             if self.kfold:
-                self.process_kext_folders(folder)
+                tasks.add("kextfolders", self.process_kext_folders, args=(out,))
             if self.cache:
-                self.process_cache(folder)
+                # Rebuilding the kextcache asks for the sudo password - so leave
+                # it until everything else is over, rather than have the prompt
+                # lost among their progress
+                tasks.add("kextcache", self.process_cache, args=(out,), after=list(tasks.order))
+            # Run all the processes needed, and gather the info
+            tasks.run()
+            if tasks.timed_out:
+                # Don't leave anything we gave up on running behind us
+                self.r.terminate_all()
+            if self.kv:
+                # Keep the kext versions we found for next time
+                self.kv.save()
+            if self.efi_cache:
+                self.efi_scan.cache.save()
+            backend = run.get_backend()
+            if self.h_serial and isinstance(backend, replay.Recorder):
+                # Keep the serial and UUID out of the recording as well
+                backend.scrub(self.get_redact)
+            for name in tasks.order:
+                if name in tasks.errors:
+                    print("{} failed: {}".format(name, tasks.errors[name]))
+                elif name in tasks.timed_out:
+                    print("{} timed out after {}s - skipped".format(name, tasks.timed_out[name]))
+                elif name in tasks.skipped:
+                    print("{} skipped - a required step failed".format(name))
+            self.process_timeouts(out, tasks)
             if self.zip:
-                self.process_zip(temp, folder_name)
+                self.process_zip(out)
             else:
-                self.process_folder(temp, folder_name)
+                self.process_folder(out)
+        except KeyboardInterrupt:
+            # Grouped commands (ioreg, system_profiler, etc) are in their own
+            # process group - so the Ctrl-C never reached them.  Stop them, and
+            # keep whatever we have so far.
+            print("Interrupted - stopping any running commands...")
+            self.r.terminate_all()
+            try: out.close()
+            except: pass
         except Exception as e:
             print("Something went wrong!")
             print(str(e))
+            try: out.close()
+            except: pass
         if clover_drive and not efi_mount:
             print("Unmounting EFI partition...")
             self.d.unmount_partition(clover_drive)
         print(" ")
         self.u.grab("Done!", timeout=5)
-        shutil.rmtree(temp)
         self.u.custom_quit()
 
-    def process_zip(self, temp, folder):
-        # Zip up the folder and move it to the Desktop
-        print("Zipping up {} and copying to desktop...".format(folder))
-        desktop = os.path.expanduser("~/Desktop")
-        fpath = os.path.join(temp, folder)
-        zippath = os.path.join(desktop, folder+".zip")
-        cdir = os.getcwd()
-        os.chdir(temp)
-        self.r.run({"args":["zip", "-r", zippath, folder]})
-        os.chdir(cdir)
-        if os.path.exists(zippath):
+    def process_zip(self, out):
+        # Finishes compressing anything still queued and closes the zip
+        print("Finishing up {}...".format(os.path.basename(out.path)))
+        out.close()
+        if os.path.exists(out.path):
             # Found it!
-            self.re.reveal(zippath, True)
-
-    def process_folder(self, temp, folder):
-        # Copies the resulting folder to the desktop
-        print("Copying {} to the desktop...".format(folder))
-        fpath = os.path.join(temp, folder)
-        dpath = os.path.join(os.path.expanduser("~/Desktop"), folder)
-        shutil.copytree(fpath, dpath)
-        if os.path.exists(dpath):
-            # Found it!
-            self.re.reveal(dpath, True)
+            self.re.reveal(out.path, True)
 
-    def process_overview(self, temp, over_text = ""):
+    def process_folder(self, out):
+        # Everything was written straight to the folder on the desktop
+        out.close()
+        if os.path.exists(out.path):
+            # Found it!
+            self.re.reveal(out.path, True)
+
+    def capture(self, out, name, comm, flag = True):
+        # Runs the passed command dict with its stdout going straight into name
+        # in the output - noting at the end if we had to stop the command, and
+        # its output is only partial.  Returns the command's output tuple.
+        with out.open(name) as f:
+            output = self.r.run(dict(comm, stdout_to=f))
+            if flag and f.written and output[2] == run.TIMED_OUT:
+                f.write("\n### {} ###\n".format(output[1].strip().split("\n")[-1]))
+        return output
+
+    def process_timeouts(self, out, tasks):
+        # Lists the collectors and commands we had to stop - if any
+        stopped = self.r.get_stopped()
+        if not tasks.timed_out and not stopped:
+            return
+        text = ""
+        if tasks.timed_out:
+            text += "### Collectors - output is missing or partial ###\n\n"
+            text += "\n".join(["{} - timed out after {}s".format(x, tasks.timed_out[x]) for x in tasks.order if x in tasks.timed_out])
+            text += "\n\n"
+        if stopped:
+            text += "### Commands ###\n\n"
+            text += "\n".join(["{} - {}".format(c, r) for c, r in stopped])
+            text += "\n"
+        out.write("- Timeouts -.txt", text)
+
+    def process_overview(self, out, over_text = ""):
         # Gets an overview of the hardware, system version, and appends any over text to it
         # Dump overview
         over = "{}\n".format("#"*self.width)
-        hs_name = self.r.run({"args":["sysctl", "-n", "kern.hostname"]})[0].strip()
+        # Everything we need is independent - so get it all at once
+        hs_name, os_name, os_vers, bd_vers, hw_name = [x[0].strip() for x in self.r.run_many([
+            {"args":["sysctl", "-n", "kern.hostname"], "cache":True},
+            {"args":["sw_vers", "-productName"], "cache":True},
+            {"args":["sw_vers", "-productVersion"], "cache":True},
+            {"args":["sw_vers", "-buildVersion"], "cache":True},
+            {"args":["system_profiler", "SPHardwareDataType"], "cache":True}
+        ])]
         over += "#{}#\n".format("{}".format(hs_name).center(self.width-2))
         over += "{}\n".format("#"*self.width)
-        os_name = self.r.run({"args":["sw_vers", "-productName"]})[0].strip()
-        os_vers = self.r.run({"args":["sw_vers", "-productVersion"]})[0].strip()
-        bd_vers = self.r.run({"args":["sw_vers", "-buildVersion"]})[0].strip()
         over += "#{}#\n".format(" "*(self.width-2))
         over += "#{}#\n".format("{} - {} ({})".format(os_name, os_vers, bd_vers).center(self.width-2))
         over += "#{}#\n".format(" "*(self.width-2))
@@ -351,7 +478,6 @@ class Essentials:
         over += "#{}#\n".format("Hardware Info From System Profiler".center(self.width-2))
         over += "{}\n\n".format("#"*self.width)
 
-        hw_name = self.r.run({"args":["system_profiler", "SPHardwareDataType"]})[0].strip()
         hw_name = "\n".join([ x.strip() for x in hw_name.split("\n")[4:] ])
         if self.h_serial:
             hw_name = hw_name.replace(self.serial, "0"*len(self.serial))
@@ -378,7 +504,7 @@ class Essentials:
             over += "\n\n".join(over_text)
 
         # Write to file
-        self.write_text(over, os.path.join(temp, "- Overview -.txt"))
+        out.write("- Overview -.txt", over)
 
     def get_stripped_config(self, config_path, hide_serial):
         # First try to load as a plist
@@ -416,7 +542,7 @@ class Essentials:
     def file_exists(self, file_path):
         return os.path.exists(file_path) and not os.path.isdir(file_path)
         
-    def process_efi(self, path_list, folder):
+    def process_efi(self, path_list, out):
         # Iterate through the paths and grab all the Clover-type info
         over_view = []
         for path in path_list:
@@ -424,228 +550,231 @@ class Essentials:
             name = self.d.get_volume_name(disk)
             t    = time.time()
             p    = path["path"]
-            is_clover = os.path.exists(os.path.join(p,"CLOVERX64.efi"))
-            acpi_path = os.path.join(p,"ACPI","patched") if is_clover else os.path.join(p,"ACPI")
+            # Everything below is answered from one listing of each folder we
+            # look at - stats are slow on a FAT32 ESP
+            inv  = inventory.Inventory(run.rebase(p))
+            is_clover = inv.exists("CLOVERX64.efi")
+            acpi_rel  = os.path.join("ACPI","patched") if is_clover else "ACPI"
             output_text = []
             print("Getting {} info from {}...".format("Clover" if is_clover else "OC", p))
             output_text.append("{} info from {}:".format("Clover" if is_clover else "OC", p))
-            p_folder = os.path.join(folder,"{} - ({} - {})".format(name, disk, "CLOVER" if is_clover else "OC"))
-            os.mkdir(p_folder)
+            p_folder = "{} - ({} - {})".format(name, disk, "CLOVER" if is_clover else "OC")
             
-            b = os.path.join(os.path.normpath(os.path.join(p, os.pardir)), "BOOT", "BOOTX64.efi")
+            b = run.rebase(os.path.join(os.path.normpath(os.path.join(p, os.pardir)), "BOOT", "BOOTX64.efi"))
             if is_clover:
                 # Check the Clover and Boot versions
-                c = os.path.join(p, "CLOVERX64.efi")
-                if os.path.exists(c): output_text.append("CLOVERX64.efi - Clover Version "+self.get_clover_version(c))
+                if inv.exists("CLOVERX64.efi"): output_text.append("CLOVERX64.efi - Clover Version "+self.get_clover_version(inv.path("CLOVERX64.efi")))
                 else: output_text.append("CLOVERX64.efi - Clover Version Not Found!")
                 if os.path.exists(b): output_text.append("BOOTX64.efi   - Clover Version "+self.get_clover_version(b))
                 else: output_text.append("BOOTX64.efi   - Clover Version Not Found!")
+            else:
+                # Check the OpenCore version and what BOOTX64.efi loads
+                if inv.exists("OpenCore.efi"): output_text.append("OpenCore.efi  - OpenCore Version "+self.get_opencore_version(inv.path("OpenCore.efi")))
+                else: output_text.append("OpenCore.efi  - OpenCore Version Not Found!")
+                if os.path.exists(b): output_text.append("BOOTX64.efi   - Boot Manager "+self.get_boot_manager(b))
+                else: output_text.append("BOOTX64.efi   - Not Found!")
             # Look for our config.plist
-            if self.file_exists(os.path.join(p, "config.plist")):
-                config_path = os.path.join(p_folder,"config.plist")
-                shutil.copy(os.path.join(p, "config.plist"), config_path)
-                status,plist_data = self.get_stripped_config(config_path,self.h_serial)
+            if inv.is_file("config.plist"):
+                status,plist_data = self.get_stripped_config(inv.path("config.plist"),self.h_serial)
                 output_text.append(status)
-                if len(plist_data): self.write_text(plist_data, config_path) # Contents updated, save them
+                if len(plist_data): out.write(os.path.join(p_folder,"config.plist"), plist_data)
             else:
                 output_text.append("config.plist NOT Found!")
             # Let's walk any ACPI directories we need
-            if os.path.exists(acpi_path):
-                output_text.append(acpi_path[len(p)+1:]) # Strip the header out
+            if inv.exists(acpi_rel):
+                output_text.append(acpi_rel)
                 d = os.path.join(p_folder, "ACPI")
-                t = time.time()
-                acpi_files = [x for x in sorted(os.listdir(acpi_path)) if not x.startswith(".") and not os.path.isdir(os.path.join(acpi_path,x))]
+                acpi_files = inv.files(acpi_rel)
                 if not len(acpi_files): output_text.append(" - None")
                 else:
                     for x in acpi_files:
                         output_text.append(" - "+x)
-                        if not os.path.exists(d):
-                            os.mkdir(d)
-                        shutil.copy(os.path.join(acpi_path, x), os.path.join(d, x))
+                        out.write_file(os.path.join(d, x), inv.path(os.path.join(acpi_rel, x)))
             # Walk any efi drivers folders we have and list the contents
             drivers = ["Drivers"] if not is_clover else ["drivers/UEFI","drivers/BIOS","drivers64","drivers32","drivers64UEFI","drivers32UEFI","UEFIDrivers","BiosDrivers"]
             for driver in drivers:
-                d_path = os.path.join(p,driver)
-                if os.path.exists(d_path) and os.path.isdir(d_path):
+                if inv.is_dir(driver):
                     output_text.append(driver)
-                    efi_files = [x for x in sorted(os.listdir(d_path)) if not x.startswith(".") and not os.path.isdir(os.path.join(d_path,x))]
-                    for x in efi_files:
+                    for x in inv.files(driver):
                         output_text.append(" - "+x)
-            # List all kexts and their versions
-            k_dir = os.path.join(p,"Kexts")
-            if os.path.exists(k_dir):
+            # List all kexts and their versions - without looking inside the
+            # bundles for more
+            if inv.exists("Kexts"):
                 output_text.append("Kexts")
-                for path, subdirs, files in os.walk(k_dir):
-                    for name in subdirs:
-                        if name.startswith(".") or not name.lower().endswith(".kext"): continue
-                        output_text.append(" - {} - {}".format(
-                            os.path.basename(path)+" -> "+name if os.path.basename(path).startswith(("10.","Other")) else name,
-                            self.get_kext_version(os.path.join(path, name))))
+                for parent, kext in inv.bundles("Kexts"):
+                    output_text.append(" - {} - {}".format(
+                        os.path.basename(parent)+" -> "+kext.name if os.path.basename(parent).startswith(("10.","Other")) else kext.name,
+                        self.get_kext_version(kext.path)))
             if is_clover:
-                # Check for debug, preboot, and origin
-                origin_path = os.path.join(p,"ACPI","origin")
-                if os.path.exists(origin_path):
-                    output_text.append(origin_path[len(p)+1:]) # Strip the header out
+                # Check for debug, preboot, and origin - only from the last hour
+                origin_rel = os.path.join("ACPI","origin")
+                if inv.exists(origin_rel):
+                    output_text.append(origin_rel)
                     d = os.path.join(p_folder, "ACPI-origin")
-                    t = time.time()
-                    acpi_files = [x for x in sorted(os.listdir(origin_path)) if not x.startswith(".") and not os.path.isdir(os.path.join(origin_path,x)) and t - os.path.getmtime(os.path.join(origin_path,x)) <= 3600]
+                    acpi_files = inv.files(origin_rel, max_age=3600, now=t)
                     if not len(acpi_files): output_text.append(" - None")
                     else:
                         for x in acpi_files:
                             output_text.append(" - "+x)
-                            if not os.path.exists(d):
-                                os.mkdir(d)
-                            shutil.copy(os.path.join(origin_path, x), os.path.join(d, x))
-                d_path = os.path.join(p,"misc","debug.log")
-                p_path = os.path.join(p,"misc","preboot.log")
-                if self.file_exists(d_path):
-                    if t - os.path.getmtime(d_path) <= 3600:
-                        shutil.copy(d_path, os.path.join(p_folder, "debug.log"))
-                        output_text.append("Located debug.log!")
-                if self.file_exists(p_path):
-                    if t - os.path.getmtime(p_path) <= 3600:
-                        shutil.copy(p_path, os.path.join(p_folder, "preboot.log"))
-                        output_text.append("Located preboot.log!")
+                            out.write_file(os.path.join(d, x), inv.path(os.path.join(origin_rel, x)))
+                for log in ("debug.log","preboot.log"):
+                    log_rel = os.path.join("misc", log)
+                    if inv.is_file(log_rel) and t - inv.mtime(log_rel) <= 3600:
+                        out.write_file(os.path.join(p_folder, log), inv.path(log_rel))
+                        output_text.append("Located {}!".format(log))
             over_view.append("\n".join(output_text))
         return over_view
 
-    def process_sysctl(self, temp):
+    def process_sysctl(self, out):
         # Dumps 'sysctl machdep.cpu' and 'sysctl machdep.xcpm'
         print("Getting sysctl cpu info...")
-        cpu = self.r.run({"args" : ["sysctl", "machdep.cpu"]})[0]
-        if len(cpu):
-            self.write_text(cpu, os.path.join(temp, "sysctl_cpu.txt"))
+        self.capture(out, "sysctl_cpu.txt", {"args" : ["sysctl", "machdep.cpu"]})
         print("Getting sysctl xcpm info...")
-        xcpm = self.r.run({"args" : ["sysctl", "machdep.xcpm"]})[0]
-        if len(xcpm):
-            self.write_text(xcpm, os.path.join(temp, "sysctl_xcpm.txt"))
+        self.capture(out, "sysctl_xcpm.txt", {"args" : ["sysctl", "machdep.xcpm"]})
                 
-    def process_patchmatic(self, temp):
+    def process_patchmatic(self, out):
         # Dumps ACPI patches via patchmatic
         print("Getting patchmatic dump...")
         if not self.patchmatic:
             print("Could not locate patchmatic!  Skipping...")
             return
-        pmf = os.path.join(temp, "patchmatic_dump")
-        if not os.path.exists(pmf):
-            os.mkdir(pmf)
-        cdir = os.getcwd()
-        os.chdir(pmf)
-        self.r.run({"args":[self.patchmatic, "-extract"]})
-        os.chdir(cdir)
-
-    def process_pmset(self, temp):
+        # patchmatic can only extract to its cwd - so run it from a scratch folder
+        # (without changing our own cwd, as other collectors may be running
+        # alongside us), then add what it dumped to the output
+        pmf = tempfile.mkdtemp()
+        try:
+            self.r.run({"args":[self.patchmatic, "-extract"], "cwd":pmf})
+            for x in sorted(os.listdir(pmf)):
+                if os.path.isdir(os.path.join(pmf, x)): continue
+                # The tables are small - so hand over their contents, rather
+                # than waiting on the zip's writer (which may be busy with a
+                # long running capture) before we can clean up
+                with open(os.path.join(pmf, x), "rb") as f:
+                    out.write(os.path.join("patchmatic_dump", x), f.read())
+        finally:
+            shutil.rmtree(pmf, ignore_errors=True)
+
+    def process_pmset(self, out):
         # Dumps the output of pmset -g and pmset -g assertions to pmset.txt
         print("Getting pmset and assertions...")
-        pmset = self.r.run({"args" : ["pmset", "-g"]})[0]
-        pmsrt = self.r.run({"args" : ["pmset", "-g", "assertions"]})[0]
-        pm_text = ""
-        if len(pmset):
-            pm_text += "### pmset -g ###\n\n" + pmset
-        if len(pmset) and len(pmsrt):
-            pm_text += "\n\n"
-        if len(pmsrt):
-            pm_text += "### pmset -g assertions ###\n\n" + pmsrt
+        pm_outs = self.r.run_many([
+            {"args" : ["pmset", "-g"]},
+            {"args" : ["pmset", "-g", "assertions"]}
+        ])
+        pm_text = "\n\n".join([
+            "### {}{} ###\n\n{}".format(title, " - partial" if o[2] == run.TIMED_OUT else "", o[0])
+            for title, o in zip(("pmset -g", "pmset -g assertions"), pm_outs) if len(o[0])
+        ])
         if len(pm_text):
-            self.write_text(pm_text, os.path.join(temp, "pmset.txt"))
+            out.write("pmset.txt", pm_text)
 
-    def process_mount_points(self, temp):
+    def process_mount_points(self, out):
         # Builds a list of mounted vols
         # disk#s# - Name - /Volumes/Name
         print("Getting mounted volumes...")
         mounts = self.d.get_mounted_volume_dicts()
         mount_string = "\n".join(sorted([ "{} - {} - {}".format(x["identifier"], x["name"], x["mount_point"]) for x in mounts ]))
         if len(mount_string):
-            self.write_text(mount_string, os.path.join(temp, "mount_points.txt"))
+            out.write("mount_points.txt", mount_string)
                 
-    def process_disks(self, temp):
-        # Pipes the output of diskutil list to a diskutil.txt file in the temp folder
+    def process_disks(self, out):
+        # Pipes the output of diskutil list to a diskutil.txt file in the output
         print("Getting diskutil list...")
-        disk = self.r.run({"args" : ["diskutil", "list"]})[0]
-        if len(disk):
-            self.write_text(disk, os.path.join(temp, "diskutil.txt"))
+        self.capture(out, "diskutil.txt", {"args" : ["diskutil", "list"]})
 
-    def process_nvram(self, temp):
-        # Pipes the output of nvram to a nvram.plist file in the temp folder
+    def process_nvram(self, out):
+        # Pipes the output of nvram to a nvram.plist file in the output
         print("Getting nvram...")
-        nvram = self.r.run({"args" : ["nvram", "-x", "-p"]})[0]
-        if len(nvram):
-            self.write_text(nvram, os.path.join(temp, "nvram.plist"))
+        # A note would break the plist - partial output is only listed in the
+        # timeouts
+        self.capture(out, "nvram.plist", {"args" : ["nvram", "-x", "-p"]}, flag=False)
 
-    def process_bdmesg(self, temp):
-        # Pipes the output of bdmesg to a bdmesg.txt file in the temp folder
+    def process_bdmesg(self, out):
+        # Pipes the output of bdmesg to a bdmesg.txt file in the output
         print("Getting bdmesg...")
         bd = bdmesg.bdmesg()
         if len(bd):
-            self.write_text(bd, os.path.join(temp, "bdmesg.txt"))
+            out.write("bdmesg.txt", bd)
 
-    def process_ioreg(self, temp):
+    def process_ioreg(self, out):
         print("Getting ioreg...")
-        folder = os.path.join(temp, "IORegistry")
-        os.mkdir(folder)
-        for plane in ["IOService","CoreCapture","IO80211Plane","IOACPIPlane","IODeviceTree","IOPower","IOUSB"]:
-            # Pipes the output of ioreg to a ioreg.txt file in the temp folder
-            ioreg = self.r.run({"args" : ["ioreg","-l","-p",plane,"-w0"]})[0]
+        # Each plane is its own ioreg - so capture up to ioreg_workers of them at
+        # once.  Each is redacted as it's written, and handed off to be
+        # compressed as soon as it's done.
+        planes = scheduler.Scheduler(self.ioreg_workers)
+        for plane in self.ioreg_planes:
+            planes.add(plane, self.process_plane, args=(out, plane))
+        planes.run()
+        for plane in planes.order:
+            if plane in planes.errors:
+                raise planes.errors[plane]
+
+    def process_plane(self, out, plane):
+        plane_path = os.path.join("IORegistry", plane+".txt")
+        r = self.get_redact()
+        if plane == "IODeviceTree":
+            # IODeviceTree is shared with bdmesg - so reuse that snapshot
+            ioreg = bdmesg.ioreg(plane)
             if len(ioreg):
-                if self.h_serial:
-                    ioreg = ioreg.replace(self.serial, "0"*len(self.serial))
-                    ioreg = ioreg.replace(self.smuuid, "-".join([ "0"*len(x) for x in self.smuuid.split("-") ]))
-                self.write_text(ioreg, os.path.join(folder, plane+".txt"))
+                if bdmesg.stopped(plane):
+                    ioreg += "\n### {} ###\n".format(bdmesg.stopped(plane))
+                out.write(plane_path, r.feed(ioreg.encode("utf-8","ignore"))+r.flush())
+            return
+        # Send the output of ioreg straight to a <plane>.txt file in the output,
+        # redacting as we go - some planes are far too large to hold in memory.
+        # Planes that return nothing are dropped when the member is closed.
+        self.capture(out, plane_path, {"args":["ioreg","-l","-p",plane,"-w0"], "transform":r})
 
-    def process_cache(self, temp):
+    def process_cache(self, out):
         print("Rebuilding the kextcache (may take some time)...")
-        # Rebuilds the cache and dumps the output
-        cache = self.c.rebuild(False)
-        if len(cache[1]):
-            # Let's dump the raw kextcache here
-            self.write_text(cache[1], os.path.join(temp, "kextcache_raw.txt"))
-            # Touch it up a bit
-            new_cache = []
-            for line in cache[1].split("\n"):
-                # Check for "file:///some/path/somekext.kext/
-                if not "file://" in line:
-                    continue
-                try: k = line.split("file://")[1].split('/"')[0]
-                except: continue
-                if len(k) and not k in new_cache:
-                    new_cache.append(k)
-            if len(new_cache):
-                self.write_text("\n".join(new_cache), os.path.join(temp, "kextcache.txt"))
-
-    def process_kextstat(self, temp):
+        # Rebuilds the cache and dumps the output - picking out the kexts it
+        # complains about as the output goes by
+        log = kextlog.KextLog()
+        # Let's dump the raw kextcache here - touching it up a bit as it goes by
+        with out.open("kextcache_raw.txt") as f:
+            cache = self.c.rebuild(False, self.kc_timeout, stderr_to=f, stderr_transform=run.LineTap(log.line))
+            if f.written and cache[2] == run.TIMED_OUT:
+                f.write("\n### {} ###\n".format(cache[1].strip().split("\n")[-1]))
+        if len(log.kexts):
+            out.write("kextcache.txt", "\n".join(log.paths()))
+        if len(log.kexts) or len(log.general):
+            out.write("kextcache_summary.txt", log.summary())
+            out.write("kextcache_summary.json", log.summary_json())
+
+    def process_kextstat(self, out):
         print("Getting kextstat...")
         # Dumps the kextstat output
-        kextstat = self.r.run({"args" : ["kextstat"]})[0]
-        if len(kextstat):
-            self.write_text(kextstat, os.path.join(temp, "kextstat.txt"))
+        self.capture(out, "kextstat.txt", {"args" : ["kextstat"]})
 
-    def process_kext_folders(self, temp):
-        if os.path.exists("/Library/Extensions/"):
+    def process_kext_folders(self, out):
+        le_path = run.rebase("/Library/Extensions/")
+        if os.path.exists(le_path):
             le = ""
             print("Getting kexts from /Library/Extensions...")
-            k_list  = os.listdir("/Library/Extensions/")
+            k_list  = os.listdir(le_path)
             k_list.sort(key=lambda x: (x.lower()))
             for k in k_list:
                 if k.startswith("."):
                     continue
                 if k.lower().endswith(".kext"):
-                    k_ver = self.get_kext_version(os.path.join("/Library/Extensions/", k))
+                    k_ver = self.get_kext_version(os.path.join(le_path, k))
                     le += "{} v{}\n".format(k, k_ver)
             if len(le):
-                self.write_text(le, os.path.join(temp, "kext-le.txt"))
-        if os.path.exists("/System/Library/Extensions/"):
+                out.write("kext-le.txt", le)
+        sle_path = run.rebase("/System/Library/Extensions/")
+        if os.path.exists(sle_path):
             sle = ""
             print("Getting kexts from /System/Library/Extensions...")
-            k_list  = os.listdir("/System/Library/Extensions/")
+            k_list  = os.listdir(sle_path)
             k_list.sort(key=lambda x: (x.lower()))
             for k in k_list:
                 if k.startswith("."):
                     continue
                 if k.lower().endswith(".kext"):
-                    k_ver = self.get_kext_version(os.path.join("/System/Library/Extensions/", k))
+                    k_ver = self.get_kext_version(os.path.join(sle_path, k))
                     sle += "{} v{}\n".format(k, k_ver)
             if len(sle):
-                self.write_text(sle, os.path.join(temp, "kexts-sle.txt"))
+                out.write("kexts-sle.txt", sle)
 
     def get_kext_version(self, path):
         if path.lower().endswith(".plist"):
@@ -654,36 +783,36 @@ class Essentials:
             plist_path = os.path.join(path, "Contents", "Info.plist")
         if not os.path.exists(plist_path):
             return "Unknown"
+        if self.kv:
+            # Only parse the Info.plist if it changed since we last saw it
+            return self.kv.lookup(plist_path, self._load_kext_version)
+        return self._load_kext_version(plist_path)
+
+    def _load_kext_version(self, plist_path):
         try:
             with open(plist_path,"rb") as f:
-                info_plist = plist.load(f)
+                # Only read as far as the key we need
+                return plist.get_key(f, "CFBundleVersion", "Unknown")
         except:
             return "Unknown"
-        return info_plist.get("CFBundleVersion", "Unknown")
         
     def get_clover_version(self, clover_path):
-        # Hex for "Clover revision: "
-        vers_hex = "Clover revision: ".encode("utf-8")
-        vers_add = len(vers_hex)
-        with open(clover_path, "rb") as f:
-            s = f.read()
-        location = s.find(vers_hex)
-        if location == -1:
-            return "Not found!"
-        location += vers_add
-        version = ""
-        while True:
-            try:
-                vnum = s[location:location+1].decode("utf-8")
-                numtest = int(vnum)
-                version += vnum
-            except:
-                break
-            location += 1
-        if not len(version):
-            return "Not found!"
-        return version
+        # Pulls the "Clover revision: " number from the binary
+        return self.efi_scan.scan(clover_path)["clover"] or "Not found!"
+
+    def get_opencore_version(self, oc_path):
+        # Pulls the "REL-XYZ-YYYY-MM-DD" build string from the binary
+        return self.efi_scan.scan(oc_path)["opencore"] or "Not found!"
+
+    def get_boot_manager(self, boot_path):
+        # Works out which boot manager the passed binary belongs to
+        return self.efi_scan.scan(boot_path)["boot_manager"] or "Unknown"
 
 if __name__ == '__main__':
     e = Essentials()
-    e.main()
+    try:
+        e.main()
+    except KeyboardInterrupt:
+        # Don't leave anything we started running in its own process group
+        e.r.terminate_all()
+        print("")
@@ -1,4 +1,56 @@
-from os.path import dirname, basename, isfile
-import glob
-modules = glob.glob(dirname(__file__)+"/*.py")
-__all__ = [ basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
\ No newline at end of file
+import os, sys, importlib
+# The helpers import each other by their bare names (import run, etc) - so load
+# them under those same names, and everyone shares one copy of each module
+_path = os.path.dirname(os.path.realpath(__file__))
+if not _path in sys.path:
+    sys.path.append(_path)
+__all__ = [
+    "archive",
+    "bdmesg",
+    "disk",
+    "efiscan",
+    "inventory",
+    "ioregistry",
+    "kextlog",
+    "plist",
+    "rebuildcache",
+    "redact",
+    "replay",
+    "reveal",
+    "run",
+    "scheduler",
+    "utils",
+    "versioncache"
+]
+
+class _Lazy(object):
+    # Stands in for a helper module - only importing it the first time
+    # something is looked up on it.  Imports are thread safe, so collectors
+    # can be the first to use a helper from any thread.
+    #
+    # Scripts.run and friends are these proxies, not modules - so
+    # isinstance(x, types.ModuleType) is False for them, and reload() won't
+    # take them.  Use sys.modules["run"] (or import run) for the real module.
+
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            module = importlib.import_module(self._name)
+            object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<lazy module {!r}>".format(self._name)
+
+for _name in __all__:
+    globals()[_name] = _Lazy(_name)
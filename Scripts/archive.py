@@ -0,0 +1,458 @@
+import os, sys, shutil, tempfile, threading, zipfile, hashlib, posixpath
+try:
+    from Queue import Queue, Full
+except:
+    from queue import Queue, Full
+
+def _encode(data):
+    # Helper to only encode if we got text
+    if sys.version_info >= (3,0) and isinstance(data, str):
+        return data.encode("utf-8","ignore")
+    return data
+
+def _read_into(path, target, digest = False, chunk_size = 1024*1024):
+    # Copies the file at path into the target file object - hashing it on the
+    # way past if digest is set, so the file's only read once.  Returns the
+    # hash, or None.
+    h = hashlib.sha1() if digest else None
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if h:
+                h.update(chunk)
+            target.write(chunk)
+    return h.hexdigest() if h else None
+
+def copy_file(src, dst):
+    # Copies src to dst and its permission bits, like shutil.copy - letting the
+    # kernel do the copying where it can.  copy_file_range (Linux, Python 3.8+)
+    # is tried first - then shutil.copyfile, which uses fcopyfile on macOS and
+    # sendfile on Linux as of Python 3.8.
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1024*1024*1024):
+                    pass
+            shutil.copymode(src, dst)
+            return dst
+        except OSError:
+            pass # Not supported between these filesystems - fall back
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    return dst
+
+class _Pool:
+    # A few threads working through queued up functions.  One failing doesn't
+    # stop the rest - each failure is kept in errors as (name, exception).
+
+    def __init__(self, workers = 4):
+        self.queue   = Queue()
+        self.errors  = []
+        self.lock    = threading.Lock()
+        self.workers = max(1, workers)
+        self.threads = []
+
+    def _worker(self):
+        while True:
+            name, func = self.queue.get()
+            try:
+                func()
+            except Exception as e:
+                with self.lock:
+                    self.errors.append((name, e))
+            finally:
+                self.queue.task_done()
+
+    def submit(self, func, name = None):
+        if len(self.threads) < self.workers:
+            # Only start threads once there's work for them
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        self.queue.put((name, func))
+
+    def wait(self):
+        self.queue.join()
+
+    @property
+    def error(self):
+        # None if everything worked - the exception itself if one thing failed,
+        # or one listing every failure
+        with self.lock:
+            errors = list(self.errors)
+        if not errors:
+            return None
+        if len(errors) == 1:
+            return errors[0][1]
+        return IOError("{} files failed to copy:\n{}".format(
+            len(errors), "\n".join("{} - {}".format(name, e) for name, e in errors)))
+
+class _Dedupe:
+    # Tracks the content we've stored - so identical files are only stored
+    # once.  Each digest maps to the first name stored with it.  Content is
+    # only claimed once it's been read in full.
+
+    def __init__(self):
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key, name):
+        # Returns the first name if the content's been claimed already -
+        # otherwise claims it for name and returns None
+        with self.lock:
+            if key in self.seen:
+                return self.seen[key]
+            self.seen[key] = name
+            return None
+
+class Member:
+    # A writable file object for a single output.  Empty members are dropped
+    # when closed, so callers don't need to check for output first.
+
+    def __init__(self, fp, on_close, check_open = None):
+        self.fp         = fp
+        self.on_close   = on_close
+        self.check_open = check_open
+        self.written    = 0
+        self.closed     = False
+
+    def write(self, data):
+        if self.check_open:
+            # Don't add to output that's already been finished
+            self.check_open()
+        data = _encode(data)
+        self.fp.write(data)
+        self.written += len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.on_close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class _Spool:
+    # What Archive members write into.  Output is spooled in memory until it
+    # outgrows spool_size - then handed to the writer thread in chunks, to be
+    # compressed straight into the zip as it comes in.  Only one member can be
+    # streaming at a time (zipfile only has the one write handle) - others that
+    # outgrow memory spill to an unnamed temp file like before.
+
+    def __init__(self, archive, name):
+        self.archive = archive
+        self.name    = name
+        self.spool   = tempfile.SpooledTemporaryFile(max_size=archive.spool_size)
+        self.size    = 0
+        self.chunks  = None # Set once we're streaming
+        self.done    = False # Set once the writer's seen the end of it
+
+    def write(self, data):
+        if self.chunks is None and self.size + len(data) > self.archive.spool_size:
+            self.chunks = self.archive._stream(self)
+        if self.chunks is None:
+            self.spool.write(data)
+            self.size += len(data)
+        else:
+            self._send(data)
+
+    def _send(self, item):
+        # The queue is bounded - so we only get ahead of the compression by a
+        # few chunks.  If the archive's closed under us, stop waiting.
+        while True:
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except Full:
+                self.archive._check_open()
+
+    def end(self):
+        # Lets the writer know there's nothing more coming
+        try:
+            self._send(None)
+        except ValueError:
+            pass # Closed - the writer's already been told
+
+class Archive:
+    # Writes outputs straight into a zip file.  Members are handed off to a
+    # single writer thread - so collectors never wait on compression, and
+    # compression overlaps with the collectors still running.
+
+    def __init__(self, path, root = "", compression = zipfile.ZIP_DEFLATED, spool_size = 8*1024*1024, dedupe = False, copy_workers = 4):
+        self.path       = path
+        self.root       = root
+        self.spool_size = spool_size
+        # Files added with write_file() are read on a few threads, and only
+        # handed to the writer once they're in memory (or a temp file past
+        # spool_size) - at most pending_reads at a time.  With dedupe they're
+        # hashed as they're read, and repeats are stored as symlinks to the
+        # first copy.  That's off by default: Windows, 7-Zip and web viewers
+        # show symlink members as tiny text files - and a zip has no other
+        # way to share one member's data, so without it repeats are stored
+        # (and compressed) in full.
+        self.dedupe     = _Dedupe() if dedupe else None
+        self.pool       = _Pool(copy_workers)
+        self.pending    = threading.Semaphore(max(1, copy_workers) * 2)
+        self.zip        = zipfile.ZipFile(path, "w", compression)
+        self.queue      = Queue()
+        self.error      = None
+        # The member being compressed as it's written, if any - Python < 3.6
+        # can't stream into a member, so waits until it's closed instead
+        self.streaming  = None
+        self.can_stream = sys.version_info >= (3,6)
+        # Once closed, anything still writing (i.e. a collector we gave up
+        # on) is turned away
+        self.closed     = False
+        self.lock       = threading.Lock()
+        self.thread     = threading.Thread(target=self._writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _arcname(self, name):
+        return "/".join([x for x in (self.root, name.replace(os.sep, "/")) if x])
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            kind, name, payload = item
+            if self.error:
+                # Already failed - just drain the queue
+                if kind in ("spool","read"):
+                    payload.close()
+                    if kind == "read":
+                        self.pending.release()
+                elif kind == "stream":
+                    self._end_stream(payload)
+                self.queue.task_done()
+                continue
+            try:
+                if kind == "data":
+                    self.zip.writestr(self._arcname(name), payload)
+                elif kind == "link":
+                    self._write_link(name, payload)
+                elif kind in ("spool","read"):
+                    payload.seek(0)
+                    if self.can_stream:
+                        with self.zip.open(self._arcname(name), "w") as f:
+                            shutil.copyfileobj(payload, f)
+                    else:
+                        # Python < 3.6 can't stream into a member
+                        self.zip.writestr(self._arcname(name), payload.read())
+                elif kind == "stream":
+                    with self.zip.open(self._arcname(name), "w") as f:
+                        # What was spooled first, then the rest as it's written
+                        payload.spool.seek(0)
+                        shutil.copyfileobj(payload.spool, f)
+                        for chunk in iter(payload.chunks.get, None):
+                            f.write(chunk)
+                    payload.done = True
+            except Exception as e:
+                self.error = e
+            finally:
+                if kind in ("spool","read"):
+                    payload.close()
+                    if kind == "read":
+                        self.pending.release()
+                elif kind == "stream":
+                    self._end_stream(payload)
+                self.queue.task_done()
+        self.zip.close()
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError("{} is already closed".format(self.path))
+
+    def _put(self, item):
+        # Queues an item for the writer - unless we've been closed
+        with self.lock:
+            self._check_open()
+            self.queue.put(item)
+
+    def write(self, name, data):
+        # Adds the passed text or bytes as a member
+        self._put(("data", name, _encode(data)))
+
+    def _stream(self, spool):
+        # Called when a member outgrows memory - returns the queue to send the
+        # rest of it through if we can stream it, otherwise None
+        with self.lock:
+            if not self.can_stream or self.streaming or self.closed:
+                return None
+            self.streaming = spool
+            spool.chunks   = Queue(maxsize=16)
+            self.queue.put(("stream", spool.name, spool))
+            return spool.chunks
+
+    def _end_stream(self, spool):
+        # Drains anything the member still sends (i.e. if writing it failed),
+        # and frees the slot for the next member that outgrows memory
+        if not spool.done:
+            for chunk in iter(spool.chunks.get, None):
+                pass
+        spool.spool.close()
+        with self.lock:
+            self.streaming = None
+
+    def _write_link(self, name, target):
+        # Stores name as a symlink to the member target - which unzip and
+        # Archive Utility restore as a link to the one copy
+        arcname = self._arcname(name)
+        info = zipfile.ZipInfo(arcname)
+        info.create_system = 3 # Unix - so the mode below is honored
+        info.external_attr = (0o120777 << 16)
+        self.zip.writestr(info, posixpath.relpath(self._arcname(target), posixpath.dirname(arcname)))
+
+    def write_file(self, name, path):
+        # Adds the file at path as a member - read (and hashed, with dedupe) in
+        # the background, so the writer only ever compresses
+        def add():
+            self.pending.acquire()
+            spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+            try:
+                key = _read_into(path, spool, bool(self.dedupe))
+                first = self.dedupe.claim(key, name) if self.dedupe else None
+            except:
+                spool.close()
+                self.pending.release()
+                raise
+            if first is None:
+                self.queue.put(("read", name, spool))
+                return
+            spool.close()
+            self.pending.release()
+            self.queue.put(("link", name, first))
+        with self.lock:
+            # close() waits on anything submitted before it
+            self._check_open()
+            self.pool.submit(add, name)
+
+    def open(self, name):
+        # Returns a Member to stream output into.  Data is spooled in memory up
+        # to spool_size and handed off to be compressed when the member's
+        # closed - anything bigger is compressed into the zip as it's written.
+        self._check_open()
+        spool = _Spool(self, name)
+        def on_close(member):
+            if spool.chunks is not None:
+                # The writer thread has it - and closes it when it's done
+                spool.end()
+                return
+            try:
+                if member.written:
+                    self._put(("spool", name, spool.spool))
+                    return
+            except ValueError:
+                pass # We were closed while it was being written
+            spool.spool.close()
+        return Member(spool, on_close, self._check_open)
+
+    def wait(self):
+        # Blocks until everything queued so far has been written - including
+        # any member that's still being streamed in
+        self.pool.wait()
+        self.queue.join()
+
+    def close(self):
+        # Waits for everything queued to be written, and finalizes the zip
+        if not self.closed:
+            with self.lock:
+                self.closed = True
+                streaming   = self.streaming
+            if streaming:
+                # Still being written (i.e. by a collector we gave up on) - keep
+                # what we have of it.  This frees up the writer for the reads
+                # the pool is still waiting to hand over.
+                streaming.chunks.put(None)
+            self.pool.wait()
+            self.queue.put(None)
+            self.thread.join()
+        if self.pool.error:
+            raise self.pool.error
+        if self.error:
+            raise self.error
+
+class Folder:
+    # Writes outputs straight into a folder - same interface as Archive
+
+    def __init__(self, path, dedupe = True, copy_workers = 4):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # Files added with write_file() are copied on a few threads.  With
+        # dedupe they're hashed as they're copied, and repeats are swapped for
+        # a hardlink to the first copy.
+        self.dedupe = _Dedupe() if dedupe else None
+        self.pool   = _Pool(copy_workers)
+        self.closed = False
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError("{} is already closed".format(self.path))
+
+    def _path(self, name):
+        path = os.path.join(self.path, name)
+        parent = os.path.dirname(path)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                # Another collector may have beaten us to it
+                if not os.path.isdir(parent):
+                    raise
+        return path
+
+    def write(self, name, data):
+        self._check_open()
+        with open(self._path(name), "wb") as f:
+            f.write(_encode(data))
+
+    def write_file(self, name, path):
+        self._check_open()
+        dest = self._path(name)
+        def copy():
+            if not self.dedupe:
+                # Let the kernel do it
+                return copy_file(path, dest)
+            with open(dest, "wb") as f:
+                key = _read_into(path, f, True)
+            shutil.copymode(path, dest)
+            first = self.dedupe.claim(key, dest)
+            if first is None:
+                return
+            # Already have this content - link to the first copy instead
+            temp = dest + ".link"
+            try:
+                os.link(first, temp)
+            except (OSError, AttributeError):
+                return # No hardlinks here - keep the copy
+            os.remove(dest)
+            os.rename(temp, dest)
+        self.pool.submit(copy, name)
+
+    def open(self, name):
+        self._check_open()
+        path = self._path(name)
+        def on_close(member):
+            member.fp.close()
+            if not member.written:
+                os.remove(path)
+        return Member(open(path, "wb"), on_close, self._check_open)
+
+    def wait(self):
+        self.pool.wait()
+
+    def close(self):
+        self.closed = True
+        self.pool.wait()
+        if self.pool.error:
+            raise self.pool.error
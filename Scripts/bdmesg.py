@@ -1,4 +1,34 @@
-import binascii, subprocess, sys
+import os, sys, threading
+sys.path.append(os.path.abspath(os.path.dirname(os.path.realpath(__file__))))
+import ioregistry, run
+
+# ioreg dumps are captured once per session and shared by every consumer -
+# along with an index of each, built the first time it's queried.  Each plane
+# has its own lock for the capture and parse - so different planes are taken
+# at the same time - while _snapshot_lock only guards the dicts themselves.
+_snapshots     = {}
+_registries    = {}
+_boot_logs     = {}
+_plane_locks   = {}
+_stopped       = {}
+_snapshot_lock = threading.Lock()
+
+# The Run we capture with - set_runner() lets the caller share theirs (and its
+# timeout), otherwise a fresh one that waits forever is used
+_runner = None
+
+def set_runner(runner):
+    global _runner
+    _runner = runner
+
+def _run(comm):
+    return (_runner or run.Run()).run(comm)
+
+def stopped(plane = "IODeviceTree"):
+    # Returns why the passed plane's capture was stopped early (its snapshot
+    # is partial), or None if it finished
+    with _snapshot_lock:
+        return _stopped.get(plane)
 
 def get_clover_uuid():
     bd = bdmesg()
@@ -21,9 +51,7 @@ def get_clover_uuid():
     return ""
 
 def get_oc_uuid():
-    p = subprocess.Popen(["nvram","4D1FDA02-38C7-4A6A-9CC6-4BCCA8B30102:boot-path"], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    oc, oe = p.communicate()
-    oc = _decode(oc)
+    oc = _run({"args":["nvram","4D1FDA02-38C7-4A6A-9CC6-4BCCA8B30102:boot-path"]})[0]
     try:
         path = oc.split("GPT,")[1].split(",")[0]
     except:
@@ -37,34 +65,74 @@ def get_bootloader_uuid():
     return b_uuid
 
 def bdmesg(just_clover = True):
-    b = "" if just_clover else _bdmesg(["ioreg","-l","-p","IOService","-w0"])
+    b = "" if just_clover else _bdmesg("IOService")
     if b == "":
-        b = _bdmesg(["ioreg","-l","-p","IODeviceTree","-w0"])
+        b = _bdmesg("IODeviceTree")
     return b
 
+def _plane_lock(plane):
+    with _snapshot_lock:
+        return _plane_locks.setdefault(plane, threading.RLock())
+
+def ioreg(plane = "IODeviceTree"):
+    # Returns the ioreg -l -w0 output for the passed plane - only running
+    # ioreg the first time each plane is requested
+    with _snapshot_lock:
+        if plane in _snapshots:
+            return _snapshots[plane]
+    with _plane_lock(plane):
+        # Someone else may have captured it while we waited
+        with _snapshot_lock:
+            if plane in _snapshots:
+                return _snapshots[plane]
+        bd = _run({"args":["ioreg","-l","-p",plane,"-w0"]})
+        with _snapshot_lock:
+            if bd[2] == run.TIMED_OUT:
+                # Keep what we got - but note that it's partial
+                _stopped[plane] = bd[1].strip().split("\n")[-1]
+            return _snapshots.setdefault(plane, bd[0])
+
+def registry(plane = "IODeviceTree"):
+    # Returns an ioregistry.Registry of the passed plane's snapshot - for
+    # looking things up without scanning the whole dump each time
+    with _snapshot_lock:
+        if plane in _registries:
+            return _registries[plane]
+    with _plane_lock(plane):
+        with _snapshot_lock:
+            if plane in _registries:
+                return _registries[plane]
+        reg = ioregistry.parse(ioreg(plane), plane)
+        with _snapshot_lock:
+            return _registries.setdefault(plane, reg)
+
+def reset():
+    # Drops any captured ioreg dumps so the next call takes a fresh snapshot
+    with _snapshot_lock:
+        _snapshots.clear()
+        _registries.clear()
+        _boot_logs.clear()
+        _stopped.clear()
+
 def _decode(var):
     if sys.version_info >= (3,0) and isinstance(var, bytes):
         var = var.decode("utf-8","ignore")
     return var
 
-def _bdmesg(comm):
-    # Runs ioreg -l -p IODeviceTree -w0 and searches for "boot-log"
-    p = subprocess.Popen(comm, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    bd, be = p.communicate()
-    bd = _decode(bd)
-    for line in bd.split("\n"):
-        # We're just looking for the "boot-log" property, then we need to format it
-        if not '"boot-log"' in line:
-            # Skip it!
-            continue
-        # Must have found it - let's try to split it, then get the hex data and process it
-        try:
-            # Split it up, then convert from hex to ascii
-            ascii_bytes = binascii.unhexlify(line.split("<")[1].split(">")[0].encode("utf-8"))
-            ascii_bytes = _decode(ascii_bytes)
-            return ascii_bytes
-        except:
-            # Failed to convert
-            return ""
-    # Didn't find it
-    return ""
+def _bdmesg(plane):
+    # Looks up "boot-log" in the index of the passed plane
+    with _snapshot_lock:
+        if plane in _boot_logs:
+            return _boot_logs[plane]
+    b = _parse_boot_log(registry(plane))
+    with _snapshot_lock:
+        _boot_logs[plane] = b
+    return b
+
+def _parse_boot_log(reg):
+    # The boot-log property is hex data - which we want as text
+    log = reg.get("boot-log")
+    if not isinstance(log, bytes):
+        # Missing, or failed to convert
+        return ""
+    return _decode(log)
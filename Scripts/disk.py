@@ -1,6 +1,11 @@
-import os, sys, shutil, re
+import os, sys, shutil, re, threading
 sys.path.append(os.path.abspath(os.path.dirname(os.path.realpath(__file__))))
-import run, plist
+import run, plist, versioncache
+
+try:
+    basestring  # Python 2
+except NameError:
+    basestring = str  # Python 3
 
 # Info pulled from: https://en.wikipedia.org/wiki/GUID_Partition_Table#Partition_type_GUIDs
 GPT_GUIDS = {
@@ -247,15 +252,39 @@ class Disk:
     def __init__(self):
         self.r = run.Run()
         self.version_re = re.compile(r"diskdump ([a-zA-z\d]+\.[a-zA-Z\d]+\.[a-zA-Z\d]+)")
-        self.diskdump,self.diskdump_version = self.check_diskdump()
-        self.full_os_version = self.r.run({"args":["sw_vers", "-productVersion"]})[0]
-        if len(self.full_os_version.split(".")) < 3:
-            # Ensure the format is XX.YY.ZZ
-            self.full_os_version += ".0"
-        self.os_version = ".".join(self.full_os_version.split(".")[:2])
+        # diskdump versions are remembered between runs - keyed on the binary's
+        # path and mtime, so we only run "diskdump version" when it changes
+        self.version_cache = versioncache.VersionCache(name="diskdump_versions.json")
         self.sudo_mount_version = "10.13.6"
         self.efi_guids = ["C12A7328-F81F-11D2-BA4B-00A0C93EC93B"]
-        self.disks = self.get_disks()
+        # Lookup tables for self.disks - rebuilt whenever it changes
+        self._indexes = self._indexed = None
+        # diskdump, diskdump_version, full_os_version, os_version, and disks are
+        # all filled in the first time they're used - see __getattr__.  Filling
+        # one can need another (disks needs diskdump), so it's reentrant.
+        self.fill_lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # Only called for attributes we don't have yet - so this is where the
+        # expensive bits get done, the first time they're needed
+        if not name in ("diskdump","diskdump_version","full_os_version","os_version","disks"):
+            raise AttributeError(name)
+        with self.fill_lock:
+            # Another thread may have filled it while we waited
+            if name in self.__dict__:
+                return self.__dict__[name]
+            if name in ("diskdump","diskdump_version"):
+                self.diskdump,self.diskdump_version = self.check_diskdump()
+            elif name in ("full_os_version","os_version"):
+                full_os_version = self.r.run({"args":["sw_vers", "-productVersion"],"cache":True})[0]
+                if len(full_os_version.split(".")) < 3:
+                    # Ensure the format is XX.YY.ZZ
+                    full_os_version += ".0"
+                # Set both together, so neither is seen without the other
+                self.full_os_version,self.os_version = full_os_version,".".join(full_os_version.split(".")[:2])
+            else:
+                self.update()
+        return self.__dict__[name]
 
     def is_guid(self, guid = None):
         try:
@@ -306,6 +335,11 @@ class Disk:
     def get_diskdump_version(self, diskdump_path):
         # Helper to attempt to extract the version from
         # "diskdump version" given a path.
+        if not os.path.exists(diskdump_path):
+            return "0.0.0"
+        return self.version_cache.lookup(diskdump_path, self._load_diskdump_version)
+
+    def _load_diskdump_version(self, diskdump_path):
         version = "0.0.0"
         if os.path.exists(diskdump_path):
             if "com.apple.quarantine" in self.r.run({"args":["xattr",diskdump_path]})[0]:
@@ -334,6 +368,7 @@ class Disk:
         desktop   = os.path.realpath(os.path.expanduser(os.path.join("~","Desktop")))+os.sep
         downloads = os.path.realpath(os.path.expanduser(os.path.join("~","Downloads")))+os.sep
         if os.getuid() == 0 or not ddpath.startswith((desktop,downloads)):
+            self.version_cache.save()
             return (ddpath,local_version)
         # If diskdump is run from a folder nested under Desktop or Downloads, it will
         # need sudo even for basic (non-ESP) mounts and unmounts.  To work around this
@@ -360,13 +395,89 @@ class Disk:
             # Update the installed_version to reflect the local_version we just
             # copied in
             installed_version = local_version
+        self.version_cache.save()
         return (ddtarget,installed_version)
 
     def update(self):
-        # Refresh our disk list
+        # Refresh our disk list - and the lookup tables built from it
         self.disks = self.get_disks()
+        self._indexes = self._build_indexes(self.disks)
+        self._indexed = self.disks
+        return self.disks
+
+    def refresh(self, disk):
+        # Re-queries just the passed volume after it's been mounted or unmounted,
+        # and patches its mount point into self.disks - so we don't need a full
+        # diskdump enumeration.  Falls back on update() if we can't.
+        if not "disks" in self.__dict__:
+            return # Nothing loaded yet - it'll be current when it is
+        disk = self.get_identifier(disk)
+        entry = self._get_indexes()["disks"].get(disk)
+        if not entry:
+            return self.update()
+        out = self.r.run({"args":["diskutil","info","-plist",disk]})
+        try:
+            assert out[2] == 0
+            # Only read the keys we need
+            info = plist.get_keys(out[0], ("DeviceIdentifier","MountPoint","VolumeName"))
+            assert info["DeviceIdentifier"] == disk
+        except:
+            return self.update()
+        old_mount = entry.get("DAVolumePath")
+        new_mount = info["MountPoint"] or None
+        name      = info["VolumeName"] or entry.get("DAVolumeName")
+        if old_mount == new_mount:
+            return self.disks
+        keys    = self._indexes["keys"]
+        mounts  = self.disks.setdefault("MountPointsFromDisks",[])
+        volumes = self.disks.setdefault("VolumesFromDisks",[])
+        if old_mount:
+            # Drop the old mount point
+            entry.pop("DAVolumePath",None)
+            if old_mount in mounts: mounts.remove(old_mount)
+            if name in volumes: volumes.remove(name)
+            if keys.get(old_mount.lower()) == disk: keys.pop(old_mount.lower())
+        if new_mount:
+            entry["DAVolumePath"] = new_mount
+            if not new_mount in mounts: mounts.append(new_mount)
+            if name: volumes.append(name)
+            keys.setdefault(new_mount.lower(),disk)
         return self.disks
 
+    def _build_indexes(self, disk_dict):
+        # Builds the lookup tables used to resolve disks without walking the
+        # whole disk dict:
+        # "all":   the lowercased AllDisks identifiers
+        # "keys":  lowercased name/UUID/mount point/identifier -> identifier
+        # "disks": identifier -> disk dict
+        # The first hit wins, matching the walk order of AllDisksAndPartitions
+        indexes = {
+            "all": set(x.lower() for x in disk_dict.get("AllDisks",[]) if isinstance(x,basestring)),
+            "keys": {},
+            "disks": {}
+        }
+        for d in disk_dict.get("AllDisksAndPartitions",[]):
+            for entry in [d]+d.get("Partitions",[]):
+                ident = entry.get("DAMediaBSDName")
+                for x in ("DAMediaBSDName","DAVolumeName","DAVolumeUUID","DAMediaUUID","DAVolumePath"):
+                    value = entry.get(x)
+                    if isinstance(value,basestring):
+                        indexes["keys"].setdefault(value.lower(),ident)
+                if ident:
+                    indexes["disks"].setdefault(ident,entry)
+        return indexes
+
+    def _get_indexes(self, disk_dict = None):
+        # Returns the lookup tables for the passed disk dict - reusing ours
+        # for self.disks as long as it hasn't been replaced
+        disk_dict = disk_dict or self.disks
+        if disk_dict is self.disks:
+            if self._indexed is not self.disks:
+                self._indexes = self._build_indexes(self.disks)
+                self._indexed = self.disks
+            return self._indexes
+        return self._build_indexes(disk_dict)
+
     def get_disks(self):
         # Check for our binary - and ensure it's setup to run
         if not os.path.exists(self.diskdump): return {}
@@ -381,19 +492,11 @@ class Disk:
         # and return the disk's identifier
         if isinstance(disk,dict): disk = disk.get("DAMediaBSDName")
         if not disk: return
-        disk_dict = disk_dict or self.disks # Normalize the dict
+        indexes = self._get_indexes(disk_dict)
         disk = disk[6:] if disk.lower().startswith("/dev/rdisk") else disk[5:] if disk.lower().startswith("/dev/disk") else disk
-        if disk.lower() in disk_dict.get("AllDisks",[]): return disk
-        for d in disk_dict.get("AllDisksAndPartitions",[]):
-            # Check the parent disk
-            if any((disk.lower()==d.get(x,"").lower() for x in ("DAMediaBSDName","DAVolumeName","DAVolumeUUID","DAMediaUUID","DAVolumePath"))):
-                return d.get("DAMediaBSDName")
-            # Check the partitions
-            for p in d.get("Partitions", []):
-                if any((disk.lower()==p.get(x,"").lower() for x in ("DAMediaBSDName","DAVolumeName","DAVolumeUUID","DAMediaUUID","DAVolumePath"))):
-                    return p.get("DAMediaBSDName")
-        # At this point, we didn't find it
-        return None
+        if disk.lower() in indexes["all"]: return disk
+        # Check the names, UUIDs, and mount points of all disks and partitions
+        return indexes["keys"].get(disk.lower())
 
     def get_parent(self, disk = None, disk_dict = None):
         # For backward compatibility with the old disk.py approach
@@ -435,18 +538,7 @@ class Disk:
         # Returns the dict info for the passed mount point, name, identifier, etc
         disk = self.get_identifier(disk,disk_dict=disk_dict)
         if not disk: return
-        parent = self.get_parent_identifier(disk,disk_dict=disk_dict)
-        # Walk AllDisksAndPartitions, and return the first hit
-        for d in (disk_dict or self.disks).get("AllDisksAndPartitions",[]):
-            d_ident = d.get("DAMediaBSDName")
-            if not d_ident:
-                continue # Did not resolve
-            if d_ident == disk:
-                return d # Got the disk
-            elif d_ident == parent:
-                # Got the parent - iterate the partitions
-                return next((p for p in d.get("Partitions",[]) if p.get("DAMediaBSDName")==disk),None)
-        return None # Didn't find it
+        return self._get_indexes(disk_dict)["disks"].get(disk)
 
     def get_efis(self, disk = None, disk_dict = None):
         # Returns the identifiers for any EFI partitions attached to the
@@ -699,15 +791,15 @@ class Disk:
         disk = self.get_identifier(disk,disk_dict=disk_dict)
         if not disk: return
         sudo = self.needs_sudo(disk,disk_dict=disk_dict)
-        out = self.r.run({"args":[self.diskdump,"mount",disk],"sudo":sudo})
-        self.update()
+        out = self.r.run({"args":[self.diskdump,"mount",disk],"sudo":sudo,"invalidate":True})
+        self.refresh(disk)
         return out
 
     def unmount_partition(self, disk, disk_dict = None, force = False):
         disk = self.get_identifier(disk,disk_dict=disk_dict)
         if not disk: return
-        out = self.r.run({"args":[self.diskdump,"forceunmount" if force else "unmount",disk]})
-        self.update()
+        out = self.r.run({"args":[self.diskdump,"forceunmount" if force else "unmount",disk],"invalidate":True})
+        self.refresh(disk)
         return out
 
     def is_mounted(self, disk, disk_dict = None):
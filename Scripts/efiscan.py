@@ -0,0 +1,82 @@
+import os, sys, re, mmap, hashlib
+sys.path.append(os.path.abspath(os.path.dirname(os.path.realpath(__file__))))
+import versioncache
+
+def _utf16(text):
+    # EFI binaries keep most of their strings as UTF-16LE
+    return re.escape(text.encode("utf-16-le"))
+
+# Every signature we look for - combined into a single pattern so each binary
+# is only scanned once.  The outer group names are what we report.
+SIGNATURES = re.compile(b"|".join((
+    # Clover's revision - i.e. "Clover revision: 5151"
+    b"(?P<clover>Clover revision: (?P<clover_rev>[0-9]+))",
+    # OpenCore's build - i.e. "REL-090-2023-03-06"
+    b"(?P<opencore>(?P<oc_type>REL|DBG|NOO)-(?P<oc_vers>[0-9]{3})-(?P<oc_date>[0-9]{4}-[0-9]{2}-[0-9]{2}))",
+    # OpenCore's Bootstrap (BOOTx64.efi) chainloads \EFI\OC\OpenCore.efi
+    b"(?P<oc_boot>" + _utf16("OpenCore.efi") + b")",
+    b"(?P<windows>" + _utf16("Windows Boot Manager") + b")",
+    b"(?P<refind>" + _utf16("rEFInd") + b")"
+)))
+
+# Boot manager names by signature, in order of preference
+BOOT_MANAGERS = (
+    ("clover",   "Clover"),
+    ("opencore", "OpenCore"),
+    ("oc_boot",  "OpenCore"),
+    ("windows",  "Windows Boot Manager"),
+    ("refind",   "rEFInd")
+)
+
+class EfiScan:
+
+    def __init__(self, cache = None):
+        # Results are cached by the binary's content hash - pass a
+        # versioncache.ContentCache to share them between runs
+        self.cache = cache or versioncache.ContentCache(name="efi_versions.json")
+
+    def scan(self, path):
+        # Returns a dict of what we found in the passed EFI binary:
+        # { "clover": "5151", "opencore": "0.9.0 (REL-090-2023-03-06)", "boot_manager": "OpenCore" }
+        # with None for anything not found.  The binary is only read once - the
+        # cache key is hashed from the same map we scan on a miss.
+        try:
+            with open(path, "rb") as f:
+                if not os.fstat(f.fileno()).st_size:
+                    return self._results({}) # Can't mmap an empty file
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    key = hashlib.sha1(m).hexdigest()
+                    return self.cache.lookup_hash(key, lambda: self._scan(m))
+                finally:
+                    m.close()
+        except (IOError, OSError, ValueError):
+            pass
+        return self._results({})
+
+    def _scan(self, m):
+        # Keeps the first match of each signature - any of them can come
+        # before a version string, so we only stop early once we've seen them
+        # all.  The boot manager is picked by priority in _results().
+        found = {}
+        for match in SIGNATURES.finditer(m):
+            name = match.lastgroup
+            if name in found:
+                continue
+            # Copy the groups out while the map is still open
+            found[name] = match.groupdict()
+            if len(found) == len(BOOT_MANAGERS):
+                break # Found everything
+        return self._results(found)
+
+    def _results(self, found):
+        results = {"clover":None,"opencore":None,"boot_manager":None}
+        if "clover" in found:
+            results["clover"] = found["clover"]["clover_rev"].decode()
+        if "opencore" in found:
+            m = found["opencore"]
+            # 090 -> 0.9.0
+            vers = ".".join(m["oc_vers"].decode())
+            results["opencore"] = "{} ({})".format(vers, m["opencore"].decode())
+        results["boot_manager"] = next((n for s,n in BOOT_MANAGERS if s in found), None)
+        return results
@@ -0,0 +1,132 @@
+import os, time
+
+class _Entry:
+    # A stand-in for os.DirEntry on Python < 3.5 - stat() is only called once
+
+    def __init__(self, folder, name):
+        self.name  = name
+        self.path  = os.path.join(folder, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return os.path.isdir(self.path)
+        except OSError:
+            return False
+
+    def is_file(self):
+        try:
+            return os.path.isfile(self.path)
+        except OSError:
+            return False
+
+def _scandir(folder):
+    if hasattr(os, "scandir"):
+        return list(os.scandir(folder))
+    return [_Entry(folder, x) for x in os.listdir(folder)]
+
+class Inventory:
+    # Lists the folders in a tree on demand - each one is only read once, and
+    # every file's stat (only taken if its size or mtime is asked for) is kept
+    # on its DirEntry.  Paths are relative to root, with "/" separators, and
+    # fall back on a case-insensitive match like the ESP's FAT32 would.
+
+    def __init__(self, root):
+        self.root    = root
+        self.folders = {} # Relative path -> (sorted entries, name -> entry, lowercase name -> entry)
+
+    def _split(self, rel):
+        return [x for x in rel.replace("\\", "/").split("/") if x and x != "."]
+
+    def _folder(self, parts):
+        # Returns the cached listing for the folder - reading it the first time
+        key = "/".join(parts)
+        if not key in self.folders:
+            if parts:
+                entry = self._lookup(parts)
+                if entry is None or not entry.is_dir():
+                    self.folders[key] = None
+                    return None
+                path = entry.path
+            else:
+                path = self.root
+            try:
+                entries = sorted(_scandir(path), key=lambda x: x.name)
+            except OSError:
+                self.folders[key] = None
+                return None
+            names = dict((x.name, x) for x in entries)
+            lower = {}
+            for x in entries:
+                lower.setdefault(x.name.lower(), x)
+            self.folders[key] = (entries, names, lower)
+        return self.folders[key]
+
+    def _lookup(self, parts):
+        # Finds the entry for the passed path parts in its parent's listing
+        folder = self._folder(parts[:-1])
+        if folder is None:
+            return None
+        entries, names, lower = folder
+        return names.get(parts[-1], lower.get(parts[-1].lower()))
+
+    def entry(self, rel):
+        # Returns the DirEntry for rel - or None if it doesn't exist
+        parts = self._split(rel)
+        return self._lookup(parts) if parts else None
+
+    def path(self, rel):
+        # The full path of rel - with the case it actually has on disk
+        entry = self.entry(rel)
+        return entry.path if entry else os.path.join(self.root, *self._split(rel))
+
+    def exists(self, rel):
+        return self.entry(rel) is not None
+
+    def is_dir(self, rel):
+        entry = self.entry(rel)
+        return entry is not None and entry.is_dir()
+
+    def is_file(self, rel):
+        entry = self.entry(rel)
+        return entry is not None and not entry.is_dir()
+
+    def mtime(self, rel):
+        entry = self.entry(rel)
+        return entry.stat().st_mtime if entry else None
+
+    def listdir(self, rel = ""):
+        # Returns the entries in rel, sorted by name - or None if it's missing
+        folder = self._folder(self._split(rel))
+        return None if folder is None else list(folder[0])
+
+    def files(self, rel = "", max_age = None, now = None):
+        # Returns the names of the non-hidden files in rel, sorted - only those
+        # modified in the last max_age seconds, if passed
+        entries = self.listdir(rel) or []
+        now = time.time() if now is None else now
+        return [
+            x.name for x in entries
+            if not x.name.startswith(".") and not x.is_dir()
+            and (max_age is None or now - x.stat().st_mtime <= max_age)
+        ]
+
+    def bundles(self, rel = "", extension = ".kext"):
+        # Walks rel top down, yielding (parent path, entry) for each non-hidden
+        # folder ending in extension - without looking inside them
+        entries = self.listdir(rel)
+        if entries is None:
+            return
+        folders = [x for x in entries if x.is_dir()]
+        for x in folders:
+            if x.name.lower().endswith(extension) and not x.name.startswith("."):
+                yield os.path.dirname(x.path), x
+        for x in folders:
+            if not x.name.lower().endswith(extension):
+                for found in self.bundles("/".join(self._split(rel) + [x.name]), extension):
+                    yield found
@@ -0,0 +1,285 @@
+import binascii, re, sys
+
+# Node lines look like:
+#   | +-o PCI0@0  <class IOPCIBridge, id 0x100000200, registered, ...>
+# where every two characters of the prefix is one level down the tree
+NODE = re.compile(r"^(?P<indent>[ |]*)\+-o (?P<name>.*?)  <class (?P<cls>[^,>]+)(?P<rest>[^>]*)>\s*$")
+ID   = re.compile(r", id (0x[0-9a-fA-F]+)")
+# Property lines look like:
+#   | |   "IOPlatformSerialNumber" = "C02..."
+PROP = re.compile(r"^[ |]*\"(?P<key>[^\"]*)\" = (?P<value>.*?)\s*$")
+
+# Names, classes and keys repeat a lot - share one copy of each
+_intern = getattr(sys, "intern", None) or intern
+
+def _decode(line):
+    if not isinstance(line, str):
+        line = line.decode("utf-8","ignore")
+    return line
+
+class Node:
+    # A single registry entry.  properties holds the raw text of each value -
+    # use get() to have it parsed.
+    __slots__ = ("name","location","cls","id","depth","parent","children","properties")
+
+    def __init__(self, name, cls, depth = 0, parent = None, id = None):
+        self.name, _, location = name.partition("@")
+        self.name       = _intern(self.name)
+        self.location   = location or None
+        self.cls        = _intern(cls)
+        self.id         = id
+        self.depth      = depth
+        self.parent     = parent
+        self.children   = []
+        self.properties = {}
+
+    @property
+    def full_name(self):
+        # The name as ioreg shows it - i.e. PCI0@0
+        return self.name + "@" + self.location if self.location else self.name
+
+    @property
+    def path(self):
+        # i.e. /AppleACPIPlatformExpert/PCI0@0/AppleACPIPCI - leaving out Root
+        names = []
+        node  = self
+        while node is not None and node.parent is not None:
+            names.append(node.full_name)
+            node = node.parent
+        return "/" + "/".join(reversed(names))
+
+    def get(self, key, default = None):
+        # Returns the parsed value for key - or default if we don't have it
+        if not key in self.properties:
+            return default
+        return parse_value(self.properties[key])
+
+    def ancestors(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def __repr__(self):
+        return "<Node {} ({})>".format(self.path, self.cls)
+
+class _Reader:
+    # Turns lines of ioreg -l output into Nodes - keeping only the branch we're
+    # currently in, and handing back each node once its properties are read
+
+    def __init__(self, keys = None, max_value = None):
+        self.keys      = set(keys) if keys is not None else None
+        self.max_value = max_value
+        self.stack     = []
+        self.node      = None
+
+    def line(self, line):
+        # Reads the next line - returning the previous node if this one starts
+        # a new node, otherwise None
+        line = _decode(line).rstrip("\r\n")
+        m = NODE.match(line)
+        if m:
+            done  = self.node
+            depth = len(m.group("indent")) // 2
+            del self.stack[depth:]
+            i = ID.search(m.group("rest"))
+            self.node = Node(m.group("name"), m.group("cls"), depth, self.stack[-1] if self.stack else None, i.group(1) if i else None)
+            self.stack.append(self.node)
+            return done
+        if self.node is None:
+            return None
+        m = PROP.match(line)
+        if not m:
+            return None
+        key, value = m.group("key"), m.group("value")
+        if self.keys is not None and not key in self.keys:
+            return None
+        if self.max_value is not None and len(value) > self.max_value:
+            return None
+        self.node.properties[_intern(key)] = value
+        return None
+
+    def close(self):
+        # Returns the last node, if any
+        done, self.node = self.node, None
+        del self.stack[:]
+        return done
+
+def iternodes(lines, keys = None, max_value = None):
+    # Yields a Node for each entry in the passed ioreg -l output (any iterable
+    # of lines - bytes or text, like an open file or a process' stdout) as soon
+    # as its properties have all been read.  Nodes are linked to their parent,
+    # but not to their children - so only the current branch is held on to.
+    #
+    # keys limits which properties are kept, and values longer than max_value
+    # characters are left out - which keeps memory bounded on huge planes.
+    reader = _Reader(keys, max_value)
+    for line in lines:
+        node = reader.line(line)
+        if node is not None:
+            yield node
+    node = reader.close()
+    if node is not None:
+        yield node
+
+class Registry:
+    # An index of the nodes in one plane - by class, name, and property key
+
+    def __init__(self, plane = None):
+        self.plane    = plane
+        self.roots    = []
+        self.nodes    = []
+        self.by_class = {}
+        self.by_name  = {}
+        self.by_key   = {}
+
+    def add(self, node):
+        if node.parent is None:
+            self.roots.append(node)
+        else:
+            node.parent.children.append(node)
+        self.nodes.append(node)
+        self.by_class.setdefault(node.cls, []).append(node)
+        self.by_name.setdefault(node.name, []).append(node)
+        if node.location:
+            self.by_name.setdefault(node.full_name, []).append(node)
+        for key in node.properties:
+            self.by_key.setdefault(key, []).append(node)
+        return node
+
+    def find(self, cls = None, name = None, key = None, under = None, where = None):
+        # Returns every node matching all of the passed criteria, in the order
+        # ioreg listed them.  name matches with or without the @location, under
+        # limits it to descendants of the passed node, and where is a function
+        # that takes a node and returns whether we want it.
+        indexes = []
+        if cls  is not None: indexes.append(self.by_class.get(cls, []))
+        if name is not None: indexes.append(self.by_name.get(name, []))
+        if key  is not None: indexes.append(self.by_key.get(key, []))
+        if not indexes:
+            indexes.append(self.nodes)
+        # Walk the shortest list and check the rest against each node
+        indexes.sort(key=len)
+        found = []
+        for node in indexes[0]:
+            if cls is not None and node.cls != cls:
+                continue
+            if name is not None and not name in (node.name, node.full_name):
+                continue
+            if key is not None and not key in node.properties:
+                continue
+            if under is not None and not under in node.ancestors():
+                continue
+            if where is not None and not where(node):
+                continue
+            found.append(node)
+        return found
+
+    def first(self, **kwargs):
+        # Returns the first node matching find()'s criteria - or None
+        found = self.find(**kwargs)
+        return found[0] if found else None
+
+    def get(self, key, default = None, **kwargs):
+        # Returns the value of key from the first node that has it - and
+        # matches any other find() criteria passed
+        node = self.first(key=key, **kwargs)
+        return default if node is None else node.get(key, default)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+class Parser:
+    # Builds a Registry from ioreg -l output fed to it in chunks of bytes.  It
+    # passes the chunks through untouched - so it can be used as a Run
+    # "transform" to index a plane while it's written out.
+
+    def __init__(self, plane = None, keys = None, max_value = None):
+        self.registry = Registry(plane)
+        self.reader   = _Reader(keys, max_value)
+        self.tail     = b""
+
+    def _add(self, node):
+        if node is not None:
+            self.registry.add(node)
+
+    def feed(self, chunk):
+        lines = (self.tail + chunk).split(b"\n")
+        self.tail = lines.pop()
+        for line in lines:
+            self._add(self.reader.line(line))
+        return chunk
+
+    def flush(self):
+        # Reads whatever's left - the Registry is complete after this
+        if self.tail:
+            self._add(self.reader.line(self.tail))
+            self.tail = b""
+        self._add(self.reader.close())
+        return b""
+
+def parse(source, plane = None, keys = None, max_value = None):
+    # Returns a Registry for the passed ioreg -l output - either all of it as
+    # bytes or text, or anything that gives lines (an open file, a pipe)
+    if isinstance(source, (bytes, str)) or (sys.version_info < (3,0) and isinstance(source, basestring)):
+        source = _decode(source).split("\n")
+    registry = Registry(plane)
+    for node in iternodes(source, keys, max_value):
+        registry.add(node)
+    return registry
+
+def _parse(text, i):
+    # Parses the value starting at text[i] - returning it and where it ended
+    c = text[i]
+    if c == '"':
+        end = text.index('"', i+1)
+        return text[i+1:end], end+1
+    if c == "<":
+        if text.startswith('<"', i):
+            # Printable data is shown as <"text">
+            end = text.index('">', i+2)
+            return text[i+2:end].encode("utf-8"), end+2
+        end = text.index(">", i+1)
+        return binascii.unhexlify(text[i+1:end].encode("utf-8")), end+1
+    if c in "{(":
+        close  = "}" if c == "{" else ")"
+        result = {} if c == "{" else []
+        i += 1
+        while True:
+            while text[i] in " ,":
+                i += 1
+            if text[i] == close:
+                return result, i+1
+            if c == "{":
+                key, i = _parse(text, i)
+                i = text.index("=", i) + 1
+                while text[i] == " ":
+                    i += 1
+                result[key], i = _parse(text, i)
+            else:
+                value, i = _parse(text, i)
+                result.append(value)
+    # A bare word - Yes/No, or a number
+    end = i
+    while end < len(text) and not text[end] in ",})":
+        end += 1
+    word = text[i:end].strip()
+    if word in ("Yes","No"):
+        return word == "Yes", end
+    try:
+        return int(word, 0), end
+    except ValueError:
+        return word, end
+
+def parse_value(raw):
+    # Turns the raw text of a value into python types - strings, bytes for
+    # data, bools, ints, dicts and lists - falling back on the raw text if we
+    # can't make sense of it
+    try:
+        value, end = _parse(raw, 0)
+    except (ValueError, IndexError, TypeError, binascii.Error):
+        return raw
+    return value if not raw[end:].strip() else raw
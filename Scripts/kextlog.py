@@ -0,0 +1,93 @@
+import re, json
+from collections import OrderedDict
+
+# Message categories - checked in order against the lowercased line, and the
+# first one with a match wins
+CATEGORIES = (
+    ("rejected",   ("rejected due to", "not allowed", "disallowed")),
+    ("unsigned",   ("not signed", "unsigned", "no code signature", "not code signed")),
+    ("dependency", ("dependenc", "unresolved", "failed to link", "link failed")),
+    ("invalid",    ("invalid", "not valid", "authenticating extension failed", "validation failed", "no executable",
+                    "bad executable", "bad signature", "bad code signature", "bad cpu type", "bad mach-o")),
+)
+
+# The noise around a kext in a message - <OSKext 0x...>, { URL = ..., ID = ... },
+# and the URL itself
+NOISE = re.compile(r"<OSKext[^>]*>|\{[^}]*\}|file://\S+")
+
+class KextLog:
+    # Collects the kexts kextcache complains about as its output streams by -
+    # pass line() to run.LineTap.  Each kext is only listed once, in the order
+    # it was first mentioned, with its messages grouped and counted by category.
+
+    def __init__(self):
+        # kext path -> category -> [count, first message]
+        self.kexts = OrderedDict()
+        # Messages that matched a category, but didn't name a kext
+        self.general = OrderedDict()
+
+    def _category(self, line):
+        lower = line.lower()
+        for category, patterns in CATEGORIES:
+            if any(p in lower for p in patterns):
+                return category
+        return "other"
+
+    def _message(self, line):
+        return " ".join(NOISE.sub(" ", line).split()).strip(" :,\"")
+
+    def line(self, line):
+        # Takes a single line of kextcache output - as bytes or text
+        if isinstance(line, bytes):
+            line = line.decode("utf-8","ignore")
+        line = line.rstrip("\r")
+        category = self._category(line)
+        if "file://" in line:
+            # Check for "file:///some/path/somekext.kext/
+            path = line.split("file://")[1].split('/"')[0]
+            if not path:
+                return
+            messages = self.kexts.setdefault(path, OrderedDict())
+        elif category != "other":
+            messages = self.general
+        else:
+            return
+        if category in messages:
+            messages[category][0] += 1
+        else:
+            messages[category] = [1, self._message(line)]
+
+    def paths(self):
+        # The kext paths, deduped, in the order they were first reported
+        return list(self.kexts)
+
+    def summary(self):
+        # Returns the kexts and their messages as text:
+        #
+        # /Library/Extensions/Some.kext - 3 messages
+        #  - invalid (2): Kext with invalid signatured (-67062) allowed
+        #  - dependency (1): ...
+        sections = []
+        groups = list(self.kexts.items())
+        if self.general:
+            groups.append(("Not tied to a kext", self.general))
+        for name, messages in groups:
+            total = sum(count for count, message in messages.values())
+            lines = ["{} - {} message{}".format(name, total, "" if total == 1 else "s")]
+            for category, (count, message) in messages.items():
+                lines.append(" - {} ({}): {}".format(category, count, message))
+            sections.append("\n".join(lines))
+        return "\n\n".join(sections)
+
+    def summary_json(self):
+        # Returns the same as summary() as JSON - for diffing and parsing:
+        #
+        # {"kexts": [{"path": "/Library/Extensions/Some.kext", "messages":
+        #   [{"category": "invalid", "count": 2, "message": "..."}]}],
+        #  "general": [{"category": ..., "count": ..., "message": ...}]}
+        def messages(group):
+            return [{"category":c,"count":count,"message":m} for c, (count, m) in group.items()]
+        return json.dumps({
+            "kexts": [{"path":path,"messages":messages(group)} for path, group in self.kexts.items()],
+            "general": messages(self.general)
+        }, indent=2)
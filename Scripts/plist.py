@@ -2,7 +2,7 @@
 # Imports #
 ###     ###
 
-import datetime, os, plistlib, struct, sys, itertools, binascii
+import datetime, os, plistlib, struct, sys, itertools, binascii, mmap, re
 from io import BytesIO
 
 if sys.version_info < (3,0):
@@ -236,6 +236,290 @@ def dumps(value, fmt=FMT_XML, skipkeys=False, sort_keys=True):
         value = value.decode("utf-8")
     return value
 
+###         ###
+# Key Lookups #
+###         ###
+
+class _StopParsing(Exception):
+    pass
+
+class _FullParse(Exception):
+    pass
+
+def get_key(fp, key, default=None, dict_type=dict):
+    # Returns the value of a single top-level key without building the whole
+    # plist - stopping as soon as the key is found.  Falls back on a full load()
+    # if the plist is malformed, or if the value is a container/data/date.
+    start = fp.tell()
+    try:
+        if _is_binary(fp):
+            try:
+                p = _BinaryPlistParser(use_builtin_types=True, dict_type=dict_type)
+            except:
+                # Python 3.9 removed use_builtin_types
+                p = _BinaryPlistParser(dict_type=dict_type)
+            return p.get_key(fp, key, default)
+        return _get_xml_key(fp, key, default)
+    except Exception:
+        pass
+    fp.seek(start)
+    value = load(fp, dict_type=dict_type)
+    if not isinstance(value, dict):
+        return default
+    return value.get(key, default)
+
+def _get_xml_key(fp, key, default=None):
+    from xml.parsers.expat import ParserCreate
+    _seek_past_whitespace(fp)
+    parser = ParserCreate()
+    # Elements at depth 3 are the keys and values of the top-level dict:
+    # <plist> -> <dict> -> <key>/<value>
+    state = {"depth":0, "text":[], "found":False, "value":_undefined}
+    def start_element(name, attrs):
+        state["depth"] += 1
+        state["text"] = []
+        if state["depth"] == 2 and name != "dict":
+            # Not a dict at the top level - there are no keys to find
+            raise _StopParsing()
+        if state["depth"] == 3 and state["found"]:
+            if name in ("true","false"):
+                state["value"] = name == "true"
+                raise _StopParsing()
+            if not name in ("string","integer","real"):
+                # Let the full parser handle anything more complex
+                raise _FullParse()
+    def end_element(name):
+        if state["depth"] == 3:
+            d = "".join(state["text"])
+            if name == "key":
+                state["found"] = d == key
+            elif state["found"]:
+                if name == "integer":
+                    d = int(d,16) if d.lower().startswith("0x") else int(d)
+                elif name == "real":
+                    d = float(d)
+                elif not _check_py3() and isinstance(d,unicode):
+                    d = d.encode("utf-8")
+                state["value"] = d
+                raise _StopParsing()
+        state["depth"] -= 1
+    def char_data(d):
+        if state["depth"] == 3:
+            state["text"].append(d)
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = char_data
+    try:
+        parser.ParseFile(fp)
+    except _StopParsing:
+        pass
+    return default if state["value"] is _undefined else state["value"]
+
+###                ###
+# Streaming Lookups  #
+###                ###
+
+def _convert(name, d, line):
+    # Turns the text of a scalar element into its value - with the same hex
+    # integer and data error handling as load()
+    if name == "string":
+        if not _check_py3() and isinstance(d,unicode):
+            d = d.encode("utf-8")
+        return d
+    if name == "integer":
+        value = int(d,16) if d.lower().startswith("0x") else int(d)
+        if -1 << 63 <= value < 1 << 64:
+            return value
+        raise OverflowError("Integer overflow at line {}".format(line))
+    if name == "real":
+        return float(d)
+    if name == "true":
+        return True
+    if name == "false":
+        return False
+    if name == "date":
+        return datetime.datetime(*[int(x) for x in re.findall(r"\d+", d)])
+    if name == "data":
+        try:
+            return wrap_data(binascii.a2b_base64(d.encode("utf-8")))
+        except Exception as e:
+            raise Exception("Data error at line {}: {}".format(line,e))
+    raise ValueError("Unknown element <{}> at line {}".format(name,line))
+
+class _EventReader:
+    # The expat handlers behind iterparse() - queuing up (path, value) events
+    # as the XML goes by
+
+    def __init__(self, parser, skip, collect, dict_type):
+        self.parser    = parser
+        self.skip      = skip
+        self.collect   = collect
+        self.dict_type = dict_type
+        self.events    = []
+        self.frames    = [] # The containers we're in - [kind, path, key/index, empty]
+        self.skipping  = 0  # How many elements deep we are in a skipped value
+        self.built     = None # Stack of [container, key] while collecting
+        self.built_path = None
+        self.text      = []
+        self.path      = None
+
+    def _line(self):
+        return self.parser.CurrentLineNumber
+
+    def _child_path(self):
+        if not self.frames:
+            return ()
+        kind, path, pos, empty = self.frames[-1]
+        return path + (pos,)
+
+    def _advance(self):
+        # Moves the current container on to its next value
+        if not self.frames:
+            return
+        frame = self.frames[-1]
+        frame[3] = False
+        frame[2] = frame[2] + 1 if frame[0] == "array" else None
+
+    def _add_built(self, value):
+        # Adds a value to the container we're collecting - or queues up the
+        # collected container once it's complete
+        if not self.built:
+            self.events.append((self.built_path, value))
+            self.built = None
+            self._advance()
+            return
+        container, key = self.built[-1]
+        if isinstance(container, list):
+            container.append(value)
+        else:
+            container[key] = value
+
+    def start(self, name, attrs):
+        self.text = []
+        if self.skipping:
+            self.skipping += 1
+            return
+        if name in ("plist","key"):
+            return
+        if self.built is not None:
+            if name in ("dict","array"):
+                self.built.append([self.dict_type() if name == "dict" else [], None])
+            return
+        path = self._child_path()
+        if self.frames and self.frames[-1][0] == "dict" and self.frames[-1][2] is None:
+            raise ValueError("Value without a key at line {}".format(self._line()))
+        if self.skip and self.skip(path):
+            self.skipping = 1
+            return
+        if name in ("dict","array"):
+            if self.collect and self.collect(path):
+                self.built = [[self.dict_type() if name == "dict" else [], None]]
+                self.built_path = path
+            else:
+                self.frames.append([name, path, None if name == "dict" else 0, True])
+            return
+        self.path = path
+
+    def end(self, name):
+        if self.skipping:
+            self.skipping -= 1
+            if not self.skipping:
+                self._advance()
+            return
+        if name == "plist":
+            return
+        d = "".join(self.text)
+        if self.built is not None:
+            if name == "key":
+                self.built[-1][1] = d
+            elif name in ("dict","array"):
+                self._add_built(self.built.pop()[0])
+            else:
+                self._add_built(_convert(name, d, self._line()))
+            return
+        if name == "key":
+            if not self.frames or self.frames[-1][0] != "dict":
+                raise ValueError("Key outside of a dict at line {}".format(self._line()))
+            self.frames[-1][2] = d
+            return
+        if name in ("dict","array"):
+            kind, path, pos, empty = self.frames.pop()
+            if empty:
+                # Nothing in it to yield - so yield it on its own
+                self.events.append((path, self.dict_type() if kind == "dict" else []))
+            self._advance()
+            return
+        self.events.append((self.path, _convert(name, d, self._line())))
+        self._advance()
+
+    def data(self, d):
+        if not self.skipping:
+            self.text.append(d)
+
+def _walk(value, skip=None, collect=None, path=()):
+    # Yields the same events as iterparse() for an already loaded plist
+    if skip and skip(path):
+        return
+    if isinstance(value, (dict, list)) and value and not (collect and collect(path)):
+        items = value.items() if isinstance(value, dict) else enumerate(value)
+        for k, v in items:
+            for x in _walk(v, skip, collect, path + (k,)):
+                yield x
+    else:
+        yield path, value
+
+def iterparse(fp, skip=None, collect=None, dict_type=dict, chunk_size=64*1024):
+    # Yields (path, value) for each value in the plist as it's read - without
+    # building the whole thing.  path is a tuple of the dict keys and array
+    # indexes leading to the value, i.e. ("AllDisksAndPartitions", 0, "Content").
+    # Only scalars and empty containers are yielded.
+    #
+    # skip(path) is asked about every value before it's read, and skips the
+    # whole value if it returns True.  collect(path) is asked about containers -
+    # returning True builds that container and yields it as a single value.
+    # Stop iterating to stop reading.
+    #
+    # Binary plists can't be read piecemeal - they're loaded, then walked.
+    # Also takes the plist as bytes or text, like loads().
+    if isinstance(fp, (basestring, bytes)):
+        fp = BytesIO(fp.encode("utf-8") if isinstance(fp, unicode) else fp)
+    if _is_binary(fp):
+        for event in _walk(load(fp, dict_type=dict_type), skip, collect):
+            yield event
+        return
+    from xml.parsers.expat import ParserCreate
+    _seek_past_whitespace(fp)
+    parser = ParserCreate()
+    reader = _EventReader(parser, skip, collect, dict_type)
+    parser.StartElementHandler = reader.start
+    parser.EndElementHandler = reader.end
+    parser.CharacterDataHandler = reader.data
+    while True:
+        chunk = fp.read(chunk_size)
+        parser.Parse(chunk, not chunk)
+        for event in reader.events:
+            yield event
+        del reader.events[:]
+        if not chunk:
+            break
+
+def get_keys(fp, keys, default=None, dict_type=dict):
+    # Returns a dict of the passed top-level keys' values - reading only those
+    # values, and stopping once we have them all.  Missing keys get default.
+    wanted = set(keys)
+    found  = {}
+    def skip(path):
+        return len(path) == 1 and not path[0] in wanted
+    def collect(path):
+        return len(path) == 1
+    for path, value in iterparse(fp, skip=skip, collect=collect, dict_type=dict_type):
+        if len(path) != 1:
+            continue
+        found[path[0]] = value
+        if len(found) == len(wanted):
+            break
+    return dict((k, found.get(k, default)) for k in keys)
+
 ###                        ###
 # Binary Plist Stuff For Py2 #
 ###                        ###
@@ -288,69 +572,166 @@ _BINARY_FORMAT = {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}
 
 _undefined = object()
 
+# Tokens whose low nibble is a size - 0xF meaning it follows as an int object
+_SIZED = frozenset((0x40, 0x50, 0x60, 0xA0, 0xD0))
+# Ints by the low nibble of their token - 8 byte ints are signed
+_INT_STRUCTS = {0: struct.Struct('>B'), 1: struct.Struct('>H'), 2: struct.Struct('>L'), 3: struct.Struct('>q')}
+_FLOAT = struct.Struct('>f')
+_DOUBLE = struct.Struct('>d')
+# Decodes text straight out of a buffer slice without copying it to bytes first
+if sys.version_info >= (3, 0):
+    _text = str
+else:
+    _text = lambda data, encoding: bytes(data).decode(encoding)
+# plistlib.Data is gone as of Python 3.9
+_Data = getattr(plistlib, "Data", None)
+
 class _BinaryPlistParser:
     """
     Read or write a binary plist file, following the description of the binary
     format.  Raise InvalidFileException in case of error, otherwise return the
     root object.
     see also: http://opensource.apple.com/source/CF/CF-744.18/CFBinaryPList.c
+
+    Works over a buffer of the whole file instead of seeking around it - the
+    file is mmap'd when it can be, and a BytesIO's buffer is used in place.
+    With data_views, data objects are returned as memoryviews into that
+    buffer instead of being copied out (Python 3 only).
     """
-    def __init__(self, use_builtin_types, dict_type):
+    def __init__(self, use_builtin_types, dict_type, data_views=False):
         self._use_builtin_types = use_builtin_types
         self._dict_type = dict_type
+        self._data_views = data_views and _check_py3()
 
     def parse(self, fp):
         try:
-            # The basic file format:
-            # HEADER
-            # object...
-            # refid->offset...
-            # TRAILER
-            self._fp = fp
-            self._fp.seek(-32, os.SEEK_END)
-            trailer = self._fp.read(32)
-            if len(trailer) != 32:
-                raise InvalidFileException()
-            (
-                offset_size, self._ref_size, num_objects, top_object,
-                offset_table_offset
-            ) = struct.unpack('>6xBBQQQ', trailer)
-            self._fp.seek(offset_table_offset)
-            self._object_offsets = self._read_ints(num_objects, offset_size)
-            self._objects = [_undefined] * num_objects
-            return self._read_object(top_object)
+            top_object = self._open(fp)
+            try:
+                return self._read_object(top_object)
+            finally:
+                self._close()
 
         except (OSError, IndexError, struct.error, OverflowError,
-                UnicodeDecodeError):
+                UnicodeDecodeError, ValueError, TypeError):
             raise InvalidFileException()
 
-    def _get_size(self, tokenL):
-        """ return the size of the next object."""
+    def get_key(self, fp, key, default=None):
+        """
+        read only the value of the passed key from the top-level dict,
+        without reading any of the other objects.
+        """
+        try:
+            top_object = self._open(fp)
+            try:
+                offset = self._object_offsets[top_object]
+                token = self._buf[offset]
+                if token & 0xF0 != 0xD0:
+                    # Not a dict
+                    return default
+                s, offset = self._get_size(token & 0x0F, offset + 1)
+                key_refs = self._read_refs(s, offset)
+                obj_refs = self._read_refs(s, offset + s * self._ref_size)
+                for k, o in zip(key_refs, obj_refs):
+                    if self._read_object(k) == key:
+                        return self._read_object(o)
+                return default
+            finally:
+                self._close()
+
+        except (OSError, IndexError, struct.error, OverflowError,
+                UnicodeDecodeError, ValueError, TypeError):
+            raise InvalidFileException()
+
+    def _open(self, fp):
+        # Gets a buffer of the whole file - without copying it where we can
+        self._map = self._view = None
+        if isinstance(fp, (bytes, bytearray, memoryview)):
+            data = fp
+        elif hasattr(fp, "getbuffer"):
+            # BytesIO - use its buffer as-is
+            data = fp.getbuffer()
+        else:
+            data = None
+            try:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                data = self._map
+            except Exception:
+                # Not a real file, or an empty one - just read it in
+                fp.seek(0)
+                data = fp.read()
+        if _check_py3():
+            # Indexing a memoryview gives ints, and slicing it doesn't copy
+            self._view = data if isinstance(data, memoryview) else memoryview(data)
+            self._buf = self._view
+        else:
+            # Python 2 - a bytearray is the closest we get
+            self._buf = bytearray(data[:])
+        return self._read_trailer()
+
+    def _close(self):
+        # Lets go of the buffer - the mmap is left to be garbage collected if
+        # we handed out views of it, or slices of it are still around (i.e. in
+        # the traceback of an error we're raising)
+        if self._view is not None and not self._data_views:
+            self._view.release()
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    pass
+        self._buf = self._view = self._map = None
+
+    def _read_trailer(self):
+        # The basic file format:
+        # HEADER
+        # object...
+        # refid->offset...
+        # TRAILER
+        if len(self._buf) < 40:
+            raise InvalidFileException()
+        (
+            offset_size, self._ref_size, num_objects, top_object,
+            offset_table_offset
+        ) = struct.unpack_from('>6xBBQQQ', self._buf, len(self._buf) - 32)
+        self._object_offsets = self._read_ints(num_objects, offset_size, offset_table_offset)
+        self._objects = [_undefined] * num_objects
+        return top_object
+
+    def _get_size(self, tokenL, offset):
+        """
+        return the size of the next object, and the offset its contents
+        start at.
+        """
         if tokenL == 0xF:
-            m = self._fp.read(1)[0]
-            if not _check_py3():
-                m = ord(m)
-            m = m & 0x3
-            s = 1 << m
-            f = '>' + _BINARY_FORMAT[s]
-            return struct.unpack(f, self._fp.read(s))[0]
-
-        return tokenL
-
-    def _read_ints(self, n, size):
-        data = self._fp.read(size * n)
+            s = 1 << (self._buf[offset] & 0x3)
+            return self._read_int(offset + 1, s), offset + 1 + s
+
+        return tokenL, offset
+
+    def _read_int(self, offset, size, signed=False):
         if size in _BINARY_FORMAT:
-            return struct.unpack('>' + _BINARY_FORMAT[size] * n, data)
-        else:
-            if not size or len(data) != size * n:
-                raise InvalidFileException()
-            return tuple(int(binascii.hexlify(data[i: i + size]),16)
-                         for i in range(0, size * n, size))
-            '''return tuple(int.from_bytes(data[i: i + size], 'big')
-                         for i in range(0, size * n, size))'''
+            f = _BINARY_FORMAT[size]
+            return struct.unpack_from('>' + (f.lower() if signed else f), self._buf, offset)[0]
+        data = self._buf[offset:offset + size]
+        if len(data) != size:
+            raise InvalidFileException()
+        if _check_py3():
+            return int.from_bytes(data, 'big', signed=signed)
+        result = int(binascii.hexlify(data), 16)
+        if signed and data[0] & 0x80:
+            result -= 1 << (size * 8)
+        return result
 
-    def _read_refs(self, n):
-        return self._read_ints(n, self._ref_size)
+    def _read_ints(self, n, size, offset):
+        if size in _BINARY_FORMAT:
+            # Decode them all in one go
+            return struct.unpack_from('>{}{}'.format(n, _BINARY_FORMAT[size]), self._buf, offset)
+        if not size or offset + size * n > len(self._buf):
+            raise InvalidFileException()
+        return tuple(self._read_int(i, size) for i in range(offset, offset + size * n, size))
+
+    def _read_refs(self, n, offset):
+        return self._read_ints(n, self._ref_size, offset)
 
     def _read_object(self, ref):
         """
@@ -361,14 +742,67 @@ class _BinaryPlistParser:
         if result is not _undefined:
             return result
 
+        buf = self._buf
         offset = self._object_offsets[ref]
-        self._fp.seek(offset)
-        token = self._fp.read(1)[0]
-        if not _check_py3():
-            token = ord(token)
+        token = buf[offset]
+        offset += 1
         tokenH, tokenL = token & 0xF0, token & 0x0F
 
-        if token == 0x00: # \x00 or 0x00
+        if tokenH in _SIZED and tokenL == 0xF:
+            # The size follows as an int object
+            s = 1 << (buf[offset] & 0x3)
+            tokenL = self._read_int(offset + 1, s)
+            offset += 1 + s
+
+        # Checked roughly in order of how common they are
+
+        if tokenH == 0x50:  # ascii string
+            result = buf[offset:offset + tokenL]
+            if len(result) != tokenL:
+                raise InvalidFileException()
+            result = _text(result, 'ascii')
+
+        elif tokenH == 0x10:  # int
+            # 8 and 16 byte ints are signed
+            if tokenL in _INT_STRUCTS:
+                result = _INT_STRUCTS[tokenL].unpack_from(buf, offset)[0]
+            else:
+                result = self._read_int(offset, 1 << tokenL, signed=True)
+
+        elif tokenH == 0xD0:  # dict
+            refs = self._read_refs(tokenL * 2, offset)
+            result = self._dict_type()
+            self._objects[ref] = result
+            read = self._read_object
+            for k, o in zip(refs[:tokenL], refs[tokenL:]):
+                key = read(k)
+                if _Data and isinstance(key, _Data):
+                    key = key.data
+                result[key] = read(o)
+
+        elif tokenH == 0xA0:  # array
+            obj_refs = self._read_refs(tokenL, offset)
+            result = []
+            self._objects[ref] = result
+            read = self._read_object
+            result.extend([read(x) for x in obj_refs])
+
+        elif tokenH == 0x40:  # data
+            result = buf[offset:offset + tokenL]
+            if len(result) != tokenL:
+                raise InvalidFileException()
+            if not self._data_views:
+                result = bytes(result)
+            if not self._use_builtin_types and _Data:
+                result = _Data(result)
+
+        elif tokenH == 0x60:  # unicode string
+            result = buf[offset:offset + tokenL * 2]
+            if len(result) != tokenL * 2:
+                raise InvalidFileException()
+            result = _text(result, 'utf-16be')
+
+        elif token == 0x00: # \x00 or 0x00
             result = None
 
         elif token == 0x08: # \x08 or 0x08
@@ -383,50 +817,22 @@ class _BinaryPlistParser:
         elif token == 0x0f: # \x0f or 0x0f
             result = b''
 
-        elif tokenH == 0x10:  # int
-            result = int(binascii.hexlify(self._fp.read(1 << tokenL)),16)
-            if tokenL >= 3: # Signed - adjust
-                result = result-((result & 0x8000000000000000) << 1)
-
         elif token == 0x22: # real
-            result = struct.unpack('>f', self._fp.read(4))[0]
+            result = _FLOAT.unpack_from(buf, offset)[0]
 
         elif token == 0x23: # real
-            result = struct.unpack('>d', self._fp.read(8))[0]
+            result = _DOUBLE.unpack_from(buf, offset)[0]
 
         elif token == 0x33:  # date
-            f = struct.unpack('>d', self._fp.read(8))[0]
+            f = _DOUBLE.unpack_from(buf, offset)[0]
             # timestamp 0 of binary plists corresponds to 1/1/2001
             # (year of Mac OS X 10.0), instead of 1/1/1970.
             result = (datetime.datetime(2001, 1, 1) +
                       datetime.timedelta(seconds=f))
 
-        elif tokenH == 0x40:  # data
-            s = self._get_size(tokenL)
-            if self._use_builtin_types or not hasattr(plistlib, "Data"):
-                result = self._fp.read(s)
-            else:
-                result = plistlib.Data(self._fp.read(s))
-
-        elif tokenH == 0x50:  # ascii string
-            s = self._get_size(tokenL)
-            result =  self._fp.read(s).decode('ascii')
-            result = result
-
-        elif tokenH == 0x60:  # unicode string
-            s = self._get_size(tokenL)
-            result = self._fp.read(s * 2).decode('utf-16be')
-
         elif tokenH == 0x80:  # UID
             # used by Key-Archiver plist files
-            result = UID(int(binascii.hexlify(self._fp.read(1 + tokenL)),16))
-
-        elif tokenH == 0xA0:  # array
-            s = self._get_size(tokenL)
-            obj_refs = self._read_refs(s)
-            result = []
-            self._objects[ref] = result
-            result.extend(self._read_object(x) for x in obj_refs)
+            result = UID(self._read_int(offset, 1 + tokenL))
 
         # tokenH == 0xB0 is documented as 'ordset', but is not actually
         # implemented in the Apple reference code.
@@ -434,18 +840,6 @@ class _BinaryPlistParser:
         # tokenH == 0xC0 is documented as 'set', but sets cannot be used in
         # plists.
 
-        elif tokenH == 0xD0:  # dict
-            s = self._get_size(tokenL)
-            key_refs = self._read_refs(s)
-            obj_refs = self._read_refs(s)
-            result = self._dict_type()
-            self._objects[ref] = result
-            for k, o in zip(key_refs, obj_refs):
-                key = self._read_object(k)
-                if hasattr(plistlib, "Data") and isinstance(key, plistlib.Data):
-                    key = key.data
-                result[key] = self._read_object(o)
-
         else:
             raise InvalidFileException()
 
@@ -26,12 +26,13 @@ class Rebuild:
         # Never differed - return None, must be equal
         return None
 
-    def rebuild(self, stream = True):
+    def rebuild(self, stream = True, timeout = None, stderr_to = None, stderr_transform = None):
+        # kextcache reports on stderr - which can be sent straight to stderr_to
         # Get os version
-        os_vers = self.r.run({"args":["sw_vers", "-productVersion"]})[0]
+        os_vers = self.r.run({"args":["sw_vers", "-productVersion"], "cache":True})[0]
         if self._compare_versions(os_vers, "10.11.0") == True:
             # We're on an OS version prior to 10.11
-            return self.r.run({"args":"sudo touch /System/Library/Extensions && sudo kextcache -u /", "stream" : stream, "shell" : True})
+            return self.r.run({"args":"sudo touch /System/Library/Extensions && sudo kextcache -u /", "stream" : stream, "shell" : True, "timeout" : timeout, "group" : False, "stderr_to" : stderr_to, "stderr_transform" : stderr_transform})
         else:
             # 10.11 or above
-            return self.r.run({"args":"sudo kextcache -i / && sudo kextcache -u /", "stream" : stream, "shell" : True})
\ No newline at end of file
+            return self.r.run({"args":"sudo kextcache -i / && sudo kextcache -u /", "stream" : stream, "shell" : True, "timeout" : timeout, "group" : False, "stderr_to" : stderr_to, "stderr_transform" : stderr_transform})
\ No newline at end of file
@@ -0,0 +1,64 @@
+import re
+
+class Redact:
+
+    def __init__(self, replacements = None, encoding = "utf-8"):
+        # replacements is a dict of text to find -> text to replace it with.
+        # Everything is matched as bytes so we never have to decode the stream.
+        self.replacements = {}
+        for find, replace in (replacements or {}).items():
+            if not find: continue # Nothing to match
+            self.replacements[find.encode(encoding)] = replace.encode(encoding)
+        # Sort longest first so overlapping values prefer the longer match
+        keys = sorted(self.replacements, key=len, reverse=True)
+        self.regex = re.compile(b"|".join(re.escape(x) for x in keys)) if keys else None
+        # A match can start at most this many bytes before the end of a chunk
+        # and still be incomplete - so that's how much we hold back
+        self.hold = max(len(x) for x in keys)-1 if keys else 0
+        self.tail = b""
+
+    def _replace(self, match):
+        return self.replacements[match.group(0)]
+
+    def feed(self, chunk):
+        # Takes the next chunk of bytes and returns whatever can be safely
+        # written out - keeping back a partial match at the end, if any
+        if not self.regex:
+            return chunk
+        buf  = self.tail + chunk
+        safe = len(buf) - self.hold
+        out  = []
+        pos  = 0
+        for m in self.regex.finditer(buf):
+            if m.start() >= safe:
+                # May be the start of a longer match - wait for more data
+                break
+            out.append(buf[pos:m.start()])
+            out.append(self.replacements[m.group(0)])
+            pos = m.end()
+        if pos < safe:
+            out.append(buf[pos:safe])
+            pos = safe
+        self.tail = buf[pos:]
+        return b"".join(out)
+
+    def flush(self):
+        # Returns whatever is left once the stream has ended
+        tail, self.tail = self.tail, b""
+        if not self.regex:
+            return tail
+        return self.regex.sub(self._replace, tail)
+
+    def stream(self, source, target, chunk_size = 65536):
+        # Copies the source file object into the target file object in chunks,
+        # redacting along the way.  Returns the number of bytes written.
+        written = 0
+        while True:
+            chunk = source.read(chunk_size)
+            data  = self.feed(chunk) if chunk else self.flush()
+            if data:
+                target.write(data)
+                written += len(data)
+            if not chunk:
+                break
+        return written
@@ -0,0 +1,356 @@
+import os, sys, json, time, shutil, threading, hashlib
+sys.path.append(os.path.abspath(os.path.dirname(os.path.realpath(__file__))))
+import run
+
+try:
+    basestring  # Python 2
+except NameError:
+    basestring = str  # Python 3
+
+# A bundle is a folder holding:
+#
+# commands.jsonl - one line per command run, in the order they finished:
+#                  {"args":..., "shell":..., "cwd":..., "start":..., "duration":...,
+#                   "returncode":..., "stdout":"output/00001.out", "stderr":...,
+#                   "files":"output/00001.files"}
+# output/        - the raw stdout and stderr of each command (if it had any),
+#                  and any files it left in its cwd (i.e. patchmatic -extract)
+# root/          - copies of the files and folders the collectors read, laid
+#                  out like the system they came from (root/EFI/OC, etc)
+INDEX  = "commands.jsonl"
+OUTPUT = "output"
+ROOT   = "root"
+
+def _key(args, shell = False, loose = False):
+    # Turns a command into something we can look it up by.  The binary is only
+    # matched on its name - so sudo, diskdump, etc can live somewhere else when
+    # replayed.  loose does the same for every absolute path passed to it.
+    if not isinstance(args, (list, tuple)):
+        return (bool(shell), args)
+    args = [x if isinstance(x, basestring) else str(x) for x in args]
+    if args:
+        args[0] = os.path.basename(args[0])
+    if loose:
+        args = [os.path.basename(x.rstrip("/")) if os.path.isabs(x) else x for x in args]
+    return (bool(shell),) + tuple(args)
+
+class _Tap:
+    # A "transform" that saves a copy of what goes to the sink to f - after
+    # the command's own transform, if any, so redacted output stays redacted
+    def __init__(self, f, transform = None):
+        self.f         = f
+        self.transform = transform
+
+    def feed(self, chunk):
+        if self.transform:
+            chunk = self.transform.feed(chunk)
+        self.f.write(chunk)
+        return chunk
+
+    def flush(self):
+        chunk = self.transform.flush() if self.transform else b""
+        self.f.write(chunk)
+        return chunk
+
+class Recorder:
+    # A run backend that runs every command for real - saving its output,
+    # return code, and how long it took to a bundle that Player can replay.
+    # Any path passed through run.rebase() is copied into the bundle's root as
+    # well - kexts only keep their Info.plists, as that's all we read of them.
+    #
+    # Output sent to a sink is saved as it was written - after its transform,
+    # so anything redacted there is redacted in the bundle too.  Everything
+    # else (output read into memory, and the copied files) is saved as-is -
+    # pass a Redact-like transform factory to scrub() once the values to hide
+    # are known to mask them across the whole bundle.
+    #
+    # run.set_backend(replay.Recorder("~/Desktop/capture"))
+
+    def __init__(self, folder, copy_files = True):
+        self.folder     = os.path.abspath(os.path.expanduser(folder))
+        self.root       = os.path.join(self.folder, ROOT)
+        self.copy_files = copy_files
+        self.copied     = set()
+        self.count      = 0
+        self.started    = time.time()
+        self.lock       = threading.Lock()
+        for path in (self.folder, os.path.join(self.folder, OUTPUT)):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        # Start a fresh index - outputs are overwritten as we go
+        open(os.path.join(self.folder, INDEX), "w").close()
+
+    def _next(self):
+        with self.lock:
+            self.count += 1
+            return self.count
+
+    def _save(self, name, data):
+        # Writes data to the bundle's output folder - returning its relative
+        # path, or None if there was nothing to save
+        if not data:
+            return None
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        with open(os.path.join(self.folder, name), "wb") as f:
+            f.write(data)
+        return name
+
+    def _listing(self, folder):
+        # Returns name -> (size, mtime) for the files in folder
+        listing = {}
+        try:
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                if os.path.isfile(path):
+                    st = os.stat(path)
+                    listing[name] = (st.st_size, st.st_mtime)
+        except OSError:
+            pass
+        return listing
+
+    def execute(self, runner, prep):
+        n     = self._next()
+        names = {1:"{}/{:05d}.out".format(OUTPUT, n), 2:"{}/{:05d}.err".format(OUTPUT, n)}
+        taps  = {}
+        prep  = dict(prep, sinks=dict(prep["sinks"]))
+        try:
+            # Anything going to a sink never comes back to us - so copy it on
+            # the way past
+            for fd, (sink, transform) in list(prep["sinks"].items()):
+                taps[fd] = open(os.path.join(self.folder, names[fd]), "wb")
+                prep["sinks"][fd] = (sink, _Tap(taps[fd], transform))
+            before = self._listing(prep["cwd"]) if prep["cwd"] else None
+            start  = time.time()
+            out    = runner._launch(prep)
+            end    = time.time()
+        finally:
+            for f in taps.values():
+                f.close()
+        entry = {
+            "args": prep["args"],
+            "shell": prep["shell"],
+            "cwd": prep["cwd"],
+            "stream": prep["stream"],
+            "start": start - self.started,
+            "duration": end - start,
+            "returncode": out[2],
+            "files": None
+        }
+        if before is not None:
+            # Keep anything it wrote to its cwd
+            after = self._listing(prep["cwd"])
+            made  = [x for x in sorted(after) if before.get(x) != after[x]]
+            if made:
+                entry["files"] = "{}/{:05d}.files".format(OUTPUT, n)
+                os.makedirs(os.path.join(self.folder, entry["files"]))
+                for name in made:
+                    shutil.copy2(os.path.join(prep["cwd"], name), os.path.join(self.folder, entry["files"], name))
+        for fd, value in ((1, out[0]), (2, out[1])):
+            name = "stdout" if fd == 1 else "stderr"
+            if fd in taps:
+                # Drop empty taps
+                path = os.path.join(self.folder, names[fd])
+                entry[name] = names[fd] if os.path.getsize(path) else None
+                if not entry[name]:
+                    os.remove(path)
+            else:
+                entry[name] = self._save(names[fd], value)
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            with open(os.path.join(self.folder, INDEX), "a") as f:
+                f.write(line)
+        return out
+
+    def scrub(self, get_transform):
+        # Runs every saved output and copied text file through a fresh
+        # transform from get_transform() - rewriting only those that change.
+        # Binaries (.efi, .aml, etc) are left alone.
+        for folder, dirs, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(folder, name)
+                if path == os.path.join(self.folder, INDEX) or not self._is_text(path):
+                    continue
+                transform = get_transform()
+                temp      = path + ".scrub"
+                try:
+                    # Outputs can be big - so go through them in chunks
+                    before, after = hashlib.sha1(), hashlib.sha1()
+                    with open(path, "rb") as f, open(temp, "wb") as t:
+                        for chunk in iter(lambda: f.read(65536), b""):
+                            before.update(chunk)
+                            chunk = transform.feed(chunk)
+                            after.update(chunk)
+                            t.write(chunk)
+                        chunk = transform.flush()
+                        after.update(chunk)
+                        t.write(chunk)
+                    if before.digest() != after.digest():
+                        shutil.copymode(path, temp)
+                        os.remove(path)
+                        os.rename(temp, path)
+                except (IOError, OSError):
+                    pass
+                if os.path.exists(temp):
+                    os.remove(temp)
+
+    def _is_text(self, path, sample = 8192):
+        # Treats a file as binary if its start has a NUL byte - or is a binary
+        # plist, which may not
+        try:
+            with open(path, "rb") as f:
+                head = f.read(sample)
+        except (IOError, OSError):
+            return False
+        return not b"\0" in head and not head.startswith(b"bplist")
+
+    def _copy(self, src, dst):
+        if not os.path.isdir(src):
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            shutil.copy2(src, dst)
+            return
+        for folder, dirs, files in os.walk(src):
+            rel  = os.path.relpath(folder, src)
+            kext = any(x.lower().endswith(".kext") for x in rel.split(os.sep))
+            if kext:
+                # Only follow the way to the Info.plist and any plugins
+                dirs[:] = [x for x in dirs if x in ("Contents","PlugIns") or x.lower().endswith(".kext")]
+            target = os.path.normpath(os.path.join(dst, rel))
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            for name in files:
+                if kext and name != "Info.plist":
+                    continue
+                try:
+                    shutil.copy2(os.path.join(folder, name), os.path.join(target, name))
+                except (IOError, OSError):
+                    pass
+
+    def rebase(self, path):
+        # Keeps a copy of path the first time it's asked for - but still has
+        # it read from where it is
+        if not self.copy_files or not os.path.isabs(path):
+            return path
+        src = os.path.normpath(path)
+        with self.lock:
+            if src in self.copied:
+                return path
+            self.copied.add(src)
+        if os.path.exists(src):
+            try:
+                self._copy(src, os.path.join(self.root, os.path.splitdrive(src)[1].lstrip("\\/")))
+            except (IOError, OSError):
+                pass
+        return path
+
+class Player:
+    # A run backend that answers every command from a Recorder's bundle -
+    # without running anything.  Commands are matched on their arguments, and
+    # the recordings of a command are handed out in the order they were made,
+    # with the last one repeated after that.  Those that were never recorded
+    # come back as "Command not found!" and are listed in missing.
+    #
+    # Output meant for a sink is fed through its transform like it would be
+    # live.  It was recorded after that transform - so transforms need to be
+    # safe to run twice, which redaction is.
+    #
+    # timing can be True to take as long as each command did when it was
+    # recorded - or a number to scale that by.  Paths passed to run.rebase()
+    # are read from the bundle's root instead.
+
+    def __init__(self, folder, timing = False, root = None):
+        self.folder  = os.path.abspath(os.path.expanduser(folder))
+        self.root    = os.path.abspath(os.path.expanduser(root)) if root else os.path.join(self.folder, ROOT)
+        self.timing  = 1.0 if timing is True else float(timing or 0)
+        self.exact   = {}
+        self.loose   = {}
+        self.missing = []
+        self.lock    = threading.Lock()
+        with open(os.path.join(self.folder, INDEX)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                args  = entry["args"]
+                args  = args if isinstance(args, basestring) else list(args)
+                for index, loose in ((self.exact, False), (self.loose, True)):
+                    index.setdefault(_key(args, entry["shell"], loose), []).append(entry)
+
+    def _find(self, prep):
+        # Returns the next unused recording of the prepared command - the last
+        # one if they've all been used, or None if there aren't any
+        with self.lock:
+            for index, loose in ((self.exact, False), (self.loose, True)):
+                entries = index.get(_key(prep["args"], prep["shell"], loose))
+                if not entries:
+                    continue
+                for entry in entries:
+                    if not entry.get("used"):
+                        entry["used"] = True
+                        return entry
+                return entries[-1]
+            self.missing.append(prep["args"])
+        return None
+
+    def _path(self, name):
+        return os.path.join(self.folder, name) if name else None
+
+    def _feed(self, runner, name, sink, transform):
+        # Feeds the recorded output to the sink in chunks - as if it were
+        # coming from the command
+        handle = runner._sink_handler(sink, transform)
+        path   = self._path(name)
+        if path:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    handle(chunk)
+        handle(b"")
+
+    def _text(self, name, target = None):
+        path = self._path(name)
+        if not path:
+            return ""
+        with open(path, "rb") as f:
+            text = f.read().decode("utf-8","ignore")
+        if target and text:
+            # Streamed commands also went to the terminal
+            target.write(text)
+            target.flush()
+        return text
+
+    def execute(self, runner, prep):
+        entry = self._find(prep)
+        if entry is None:
+            return ("", "Command not found!", 1)
+        start  = time.time()
+        output = []
+        for fd, name in ((1, entry.get("stdout")), (2, entry.get("stderr"))):
+            if fd in prep["sinks"]:
+                self._feed(runner, name, *prep["sinks"][fd])
+                output.append("")
+            else:
+                output.append(self._text(name, (sys.stdout if fd == 1 else sys.stderr) if prep["stream"] else None))
+        if entry.get("files") and prep["cwd"]:
+            files = self._path(entry["files"])
+            for name in os.listdir(files):
+                shutil.copy2(os.path.join(files, name), os.path.join(prep["cwd"], name))
+        out = (output[0], output[1], entry["returncode"])
+        if self.timing:
+            wait    = entry["duration"] * self.timing
+            timeout = prep["timeout"]
+            if timeout and wait > timeout and out[2] != run.TIMED_OUT:
+                # It wouldn't have finished in time here - stop it like Run would
+                time.sleep(max(0, timeout - (time.time() - start)))
+                stopped = {"reason":"Timed out after {}s".format(timeout)}
+                return runner._partial(out, runner._note_stopped(prep["args"], stopped))
+            time.sleep(max(0, wait - (time.time() - start)))
+        return out
+
+    def rebase(self, path):
+        # Points absolute paths at the bundle's copy
+        if not os.path.isabs(path):
+            return path
+        rebased = os.path.join(self.root, os.path.splitdrive(path)[1].lstrip("\\/"))
+        # Keep any trailing separator
+        return rebased + os.sep if path.endswith(("/","\\")) and not rebased.endswith(os.sep) else rebased
@@ -1,19 +1,307 @@
-import sys, subprocess, time, threading, shlex
+import sys, os, re, subprocess, time, threading, shlex, codecs, io, signal
 try:
     from Queue import Queue, Empty
 except:
     from queue import Queue, Empty
+try:
+    import selectors
+except ImportError:
+    # Python 2 - fall back on the threaded reader
+    selectors = None
+# asyncio is slow to import - so it's only loaded the first time run_many()
+# needs it, by _load_asyncio()
+asyncio = None
 
 ON_POSIX = 'posix' in sys.builtin_module_names
 
+# Commands that only read system state - and are safe to cache when a
+# command dict passes "cache".  Matched against the start of the argv.
+CACHEABLE = (
+    ("sw_vers",),
+    ("system_profiler",),
+    ("sysctl", "-n"),
+    ("sysctl", "machdep.cpu"),
+    ("sysctl", "machdep.xcpm"),
+    ("which",),
+    ("diskutil", "list"),
+    ("diskutil", "info")
+)
+
+# Shell operators - a whitelisted command with any of these in its args isn't
+# cached, in case it's being handed to a shell some other way
+SHELL_CHARS = re.compile(r"[;&|<>`$\n]")
+
+# Return code for commands stopped before they finished - same as coreutils'
+# timeout.  Their stderr ends with a note saying why.
+TIMED_OUT = 124
+
+# What run_many() returns for a command with no args - so the outputs still
+# line up with the commands
+EMPTY = ("", "", 0)
+
+# Shared by every Run instance so cached results are process-wide
+_cache      = {}
+_cache_lock = threading.Lock()
+
+# Running commands - so they can be stopped from anywhere - and the commands we
+# had to stop, as (command, reason) tuples
+_active      = {}
+_stopped     = []
+_active_lock = threading.Lock()
+
+# Runs every command in place of spawning it - i.e. replay.Recorder or
+# replay.Player.  Shared by every Run instance, like the cache.
+_backend = None
+
+_CollectProtocol = None
+
+def _load_asyncio():
+    # Imports asyncio and sets up _CollectProtocol the first time it's called -
+    # returns False if we can't (Python 2), and run_many() runs one at a time
+    global asyncio, _CollectProtocol
+    if _CollectProtocol is not None:
+        return True
+    try:
+        import asyncio as _asyncio
+    except ImportError:
+        return False
+
+    class CollectProtocol(_asyncio.SubprocessProtocol):
+        # Gathers a process' output - passing it to on_done once the process
+        # has exited and both of its pipes are closed, or finish() is called
+
+        def __init__(self, on_start, on_done):
+            self.on_start  = on_start
+            self.on_done   = on_done
+            self.transport = None
+            self.finished  = False
+            self.output    = {1:[], 2:[]}
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.on_start(self)
+
+        def pipe_data_received(self, fd, data):
+            self.output[fd].append(data)
+
+        def connection_lost(self, exc):
+            self.finish()
+
+        def finish(self):
+            if self.finished:
+                return
+            self.finished = True
+            self.on_done(b"".join(self.output[1]), b"".join(self.output[2]), self.transport.get_returncode())
+            # Kills the process if it's somehow still running
+            self.transport.close()
+
+    asyncio = _asyncio
+    _CollectProtocol = CollectProtocol
+    return True
+
+def set_backend(backend):
+    # Sends every command through backend.execute(run, prep) - or back to
+    # being run for real if backend is None
+    global _backend
+    _backend = backend
+
+def get_backend():
+    return _backend
+
+def rebase(path):
+    # Returns where the passed system path (i.e. /Library/Extensions) is to
+    # be read from - the backend can point it at a captured copy
+    return _backend.rebase(path) if _backend else path
+
+class LineTap:
+    # A transform for "transform"/"stderr_transform" that passes output through
+    # untouched - calling callback with each complete line (as bytes, without
+    # its newline) along the way
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.tail     = b""
+
+    def feed(self, chunk):
+        lines = (self.tail + chunk).split(b"\n")
+        self.tail = lines.pop()
+        for line in lines:
+            self.callback(line)
+        return chunk
+
+    def flush(self):
+        if self.tail:
+            self.callback(self.tail)
+            self.tail = b""
+        return b""
+
 class Run:
 
     def __init__(self):
+        # Default number of seconds a cached result is valid for
+        self.cache_ttl  = 300
+        # Default number of seconds a command can run before it's stopped - can
+        # be overridden per command with "timeout".  None waits forever.
+        self.timeout    = None
+        # Seconds between asking a command to quit and killing it
+        self.kill_grace = 2
         return
 
+    def _cache_key(self, comm, shell = False):
+        # Returns a hashable argv for the passed command if it's cacheable,
+        # or None if not.  Only argv lists are - a string (or anything run
+        # through the shell) can chain other commands onto a whitelisted one.
+        if shell or not isinstance(comm, (list, tuple)) or not comm:
+            return None
+        argv = list(comm)
+        if any(SHELL_CHARS.search(x) for x in argv):
+            return None
+        argv[0] = os.path.basename(argv[0])
+        if not any(tuple(argv[:len(x)]) == x for x in CACHEABLE):
+            return None
+        return tuple(argv)
+
+    def _get_cached(self, key, ttl):
+        with _cache_lock:
+            entry = _cache.get(key)
+        if not entry:
+            return None
+        if ttl is not None and time.time() - entry[0] > ttl:
+            return None
+        return entry[1]
+
+    def _set_cached(self, key, out):
+        with _cache_lock:
+            _cache[key] = (time.time(), out)
+
+    def invalidate(self, *prefix):
+        # Drops cached results - either all of them, or only those whose argv
+        # starts with the passed prefix.  i.e. invalidate("diskutil")
+        with _cache_lock:
+            if not prefix:
+                _cache.clear()
+                return
+            for key in list(_cache):
+                if key[:len(prefix)] == prefix:
+                    del _cache[key]
+
+    def _popen_args(self, group = False):
+        # Starts the command in its own process group, so stopping it also stops
+        # anything it started.  Only used for commands that don't need the
+        # terminal - a new session has no tty for sudo to prompt on.
+        if not group or not ON_POSIX:
+            return {}
+        if sys.version_info >= (3,2):
+            return {"start_new_session":True}
+        return {"preexec_fn":os.setsid}
+
+    def _track(self, target = None, group = False, loop = None):
+        # Registers a running command so it can be stopped from anywhere.
+        # target is its Popen object - or asyncio transport when run on loop.
+        entry = {"target":target, "group":group, "loop":loop, "expired":None, "reason":None, "abandon":None}
+        with _active_lock:
+            _active[id(entry)] = entry
+        return entry
+
+    def _untrack(self, entry):
+        with _active_lock:
+            _active.pop(id(entry), None)
+
+    def _signal(self, entry, kill = False):
+        target = entry["target"]
+        try:
+            if entry["group"] and ON_POSIX:
+                pid = target.pid if hasattr(target, "pid") else target.get_pid()
+                os.killpg(pid, signal.SIGKILL if kill else signal.SIGTERM)
+            elif kill:
+                target.kill()
+            else:
+                target.terminate()
+        except Exception:
+            # Already gone
+            pass
+
+    def _call(self, entry, func, *args):
+        # Calls func - on the entry's event loop if it has one
+        if not entry["loop"]:
+            return func(*args)
+        try:
+            entry["loop"].call_soon_threadsafe(lambda: func(*args))
+        except RuntimeError:
+            # The loop is closed - so the command has finished
+            pass
+
+    def _later(self, delay, entry, func, *args):
+        t = threading.Timer(delay, self._call, (entry, func) + args)
+        t.daemon = True
+        t.start()
+
+    def _expire(self, entry, reason = None):
+        # Asks the command - and anything it started - to quit, then kills it if
+        # it's still around after kill_grace seconds
+        if entry["expired"]:
+            return
+        entry["expired"] = time.time()
+        entry["reason"]  = reason or "Stopped early"
+        self._call(entry, self._signal, entry)
+        self._later(self.kill_grace, entry, self._signal, entry, True)
+        if entry["abandon"]:
+            # Stop waiting on anything it left holding our pipes open
+            self._later(self.kill_grace*2, entry, entry["abandon"])
+
+    def _abandoned(self, entry):
+        # True once we've given a stopped command long enough to close its pipes
+        return bool(entry["expired"]) and time.time() - entry["expired"] >= self.kill_grace*2
+
+    def _note_stopped(self, comm, entry):
+        # Records that we had to stop the command - and returns why
+        if type(comm) is list:
+            comm = " ".join(comm)
+        note = "{} - output is partial".format(entry["reason"])
+        with _active_lock:
+            _stopped.append((comm, note))
+        return note
+
+    def _partial(self, out, note):
+        # Flags the output of a command we had to stop - whatever it managed to
+        # write is kept as-is
+        err = out[1] + ("\n" if len(out[1]) and not out[1].endswith("\n") else "")
+        return (out[0], err + note + "\n", TIMED_OUT)
+
+    def stop_after(self, p, comm, timeout = None, group = False):
+        # Stops the already running Popen object p if it's still going after
+        # timeout seconds (or terminate_all() is called).  Returns a function to
+        # call once it's done - which returns why it was stopped, or None.
+        entry = self._track(p, group)
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._expire, (entry, "Timed out after {}s".format(timeout)))
+            timer.daemon = True
+            timer.start()
+        def finished():
+            if timer:
+                timer.cancel()
+            self._untrack(entry)
+            return self._note_stopped(comm, entry) if entry["expired"] else None
+        return finished
+
+    def terminate_all(self):
+        # Stops every command still running - i.e. those left behind by a
+        # collector we gave up on
+        with _active_lock:
+            entries = list(_active.values())
+        for entry in entries:
+            self._expire(entry)
+
+    def get_stopped(self):
+        # Returns a list of (command, reason) for every command we had to stop
+        with _active_lock:
+            return list(_stopped)
+
     def _read_output(self, pipe, q):
         try:
-            for line in iter(lambda: pipe.read(1), b''):
+            # Text mode pipes return "" at EOF - which is also b"" on py2
+            for line in iter(lambda: pipe.read(1), ""):
                 q.put(line)
         except ValueError:
             pass
@@ -26,15 +314,133 @@ class Run:
         t.daemon = True
         return (q,t)
 
-    def _stream_output(self, comm, shell = False):
+    def _stream_output(self, comm, shell = False, cwd = None, timeout = None, group = False, sinks = None):
+        # Select on the pipes where we can - Windows can't select on pipes,
+        # and py2 doesn't have selectors
+        if selectors and ON_POSIX:
+            return self._stream_select(comm, shell, cwd, timeout=timeout, group=group, sinks=sinks)
+        if sinks:
+            return self._run_pumped(comm, shell, cwd, timeout=timeout, group=group, sinks=sinks)
+        return self._stream_threaded(comm, shell, cwd, timeout=timeout, group=group)
+
+    def _text_handler(self, target, collected, translate = True):
+        # Returns a function taking raw chunks of output (b"" at EOF) that
+        # decodes them incrementally - so multi-byte chars split across reads
+        # come through intact - and collects them, writing them to target too
+        # if passed.  translate mirrors universal_newlines.
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")("ignore"), translate)
+        def handle(chunk):
+            # EOF - flush anything the decoder is holding onto
+            text = decoder.decode(chunk, final=not chunk)
+            if text:
+                if target:
+                    target.write(text)
+                    target.flush()
+                collected.append(text)
+        return handle
+
+    def _sink_handler(self, sink, transform = None):
+        # Returns a function taking raw chunks of output (b"" at EOF) that
+        # writes them to sink - a file object or descriptor - as-is, or
+        # through transform's feed() and flush() if passed
+        def write(data):
+            if not data:
+                return
+            if isinstance(sink, int):
+                while data:
+                    data = data[os.write(sink, data):]
+            else:
+                sink.write(data)
+        def handle(chunk):
+            if transform:
+                write(transform.feed(chunk) if chunk else transform.flush())
+            else:
+                write(chunk)
+        return handle
+
+    def _popen_pipes(self, sinks):
+        # Descriptors without a transform are handed straight to the command -
+        # everything else comes to us through a pipe
+        pipes = []
+        for fd in (1, 2):
+            sink, transform = sinks.get(fd, (None, None))
+            pipes.append(sink if isinstance(sink, int) and not transform else subprocess.PIPE)
+        return pipes
+
+    def _handlers(self, p, sinks, tee, output, error):
+        # Pairs each of p's pipes with the function handling its output
+        handlers = []
+        for pipe, fd, target, collected in ((p.stdout, 1, sys.stdout, output), (p.stderr, 2, sys.stderr, error)):
+            if pipe is None:
+                continue
+            if fd in sinks:
+                handlers.append((pipe, self._sink_handler(*sinks[fd])))
+            else:
+                handlers.append((pipe, self._text_handler(target if tee else None, collected, tee)))
+        return handlers
+
+    def _stream_select(self, comm, shell = False, cwd = None, chunk_size = 65536, timeout = None, group = False, tee = True, sinks = None):
+        # Waits on both pipes with a selector and handles whatever is available
+        # in chunks.  With tee off, the output is only collected.  sinks maps
+        # 1 (stdout) and/or 2 (stderr) to a (sink, transform) tuple to send that
+        # output to instead - it's never held in memory, and comes back as "".
+        sinks = sinks or {}
+        output, error = [], []
+        p = entry = None
+        try:
+            if shell and type(comm) is list:
+                comm = " ".join(shlex.quote(x) for x in comm)
+            if not shell and type(comm) is str:
+                comm = shlex.split(comm)
+            stdout, stderr = self._popen_pipes(sinks)
+            p = subprocess.Popen(comm, shell=shell, stdout=stdout, stderr=stderr, close_fds=ON_POSIX, cwd=cwd, **self._popen_args(group))
+            entry = self._track(p, group)
+            deadline = time.time() + timeout if timeout else None
+            sel = selectors.DefaultSelector()
+            for pipe, handle in self._handlers(p, sinks, tee, output, error):
+                sel.register(pipe, selectors.EVENT_READ, handle)
+            while sel.get_map():
+                if deadline and time.time() >= deadline:
+                    self._expire(entry, "Timed out after {}s".format(timeout))
+                if self._abandoned(entry):
+                    break
+                # Wake up now and then to check if we need to stop
+                for key, _ in sel.select(0.25):
+                    # The pipe is readable - so this won't block
+                    chunk = os.read(key.fd, chunk_size)
+                    if not chunk:
+                        sel.unregister(key.fileobj)
+                        key.fileobj.close()
+                    key.data(chunk)
+            for key in list(sel.get_map().values()):
+                # Gave up on it - but still flush what we have
+                key.fileobj.close()
+                key.data(b"")
+            sel.close()
+            p.wait()
+            out = ("".join(output), "".join(error), p.returncode)
+            return self._partial(out, self._note_stopped(comm, entry)) if entry["expired"] else out
+        except:
+            if p:
+                try: p.wait()
+                except: pass
+                return ("".join(output), "".join(error), p.returncode)
+            return ("", "Command not found!", 1)
+        finally:
+            if entry:
+                self._untrack(entry)
+
+    def _stream_threaded(self, comm, shell = False, cwd = None, timeout = None, group = False):
         output = error = ""
-        p = None
+        p = entry = None
         try:
             if shell and type(comm) is list:
                 comm = " ".join(shlex.quote(x) for x in comm)
             if not shell and type(comm) is str:
                 comm = shlex.split(comm)
-            p = subprocess.Popen(comm, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0, universal_newlines=True, close_fds=ON_POSIX)
+            p = subprocess.Popen(comm, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0, universal_newlines=True, close_fds=ON_POSIX, cwd=cwd, **self._popen_args(group))
+            entry = self._track(p, group)
+            deadline = time.time() + timeout if timeout else None
             # Setup the stdout thread/queue
             q,t   = self._create_thread(p.stdout)
             qe,te = self._create_thread(p.stderr)
@@ -62,9 +468,16 @@ class Run:
                 if p.returncode != None:
                     # Subprocess ended
                     break
+                if deadline and time.time() >= deadline:
+                    self._expire(entry, "Timed out after {}s".format(timeout))
                 # No output, but subprocess still running - stall for 20ms
                 time.sleep(0.02)
 
+            if entry["expired"]:
+                # Anything it started may still hold the pipes open - so don't
+                # wait on them
+                p.wait()
+                return self._partial((output, error, p.returncode), self._note_stopped(comm, entry))
             o, e = p.communicate()
             return (output+o, error+e, p.returncode)
         except:
@@ -73,6 +486,9 @@ class Run:
                 except: o = e = ""
                 return (output+o, error+e, p.returncode)
             return ("", "Command not found!", 1)
+        finally:
+            if entry:
+                self._untrack(entry)
 
     def _decode(self, value, encoding="utf-8", errors="ignore"):
         # Helper method to only decode if bytes type
@@ -80,71 +496,309 @@ class Run:
             return value.decode(encoding,errors)
         return value
 
-    def _run_command(self, comm, shell = False):
-        c = None
+    def _pump(self, pipe, handle, chunk_size = 65536):
+        # Feeds everything read from pipe to handle - then b"" at EOF
+        try:
+            for chunk in iter(lambda: pipe.read(chunk_size), b""):
+                handle(chunk)
+        except ValueError:
+            pass
+        handle(b"")
+        pipe.close()
+
+    def _run_pumped(self, comm, shell = False, cwd = None, timeout = None, group = False, tee = True, sinks = None):
+        # Like _stream_select - but with a thread per pipe, for when we can't
+        # select on them
+        sinks = sinks or {}
+        output, error = [], []
+        finished = None
+        try:
+            if shell and type(comm) is list:
+                comm = " ".join(shlex.quote(x) for x in comm)
+            if not shell and type(comm) is str:
+                comm = shlex.split(comm)
+            stdout, stderr = self._popen_pipes(sinks)
+            p = subprocess.Popen(comm, shell=shell, stdout=stdout, stderr=stderr, cwd=cwd, **self._popen_args(group))
+            finished = self.stop_after(p, comm, timeout, group)
+            threads = []
+            for pipe, handle in self._handlers(p, sinks, tee, output, error):
+                t = threading.Thread(target=self._pump, args=(pipe, handle))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+            p.wait()
+        except:
+            if finished: finished()
+            return ("", "Command not found!", 1)
+        out = ("".join(output), "".join(error), p.returncode)
+        note = finished()
+        return self._partial(out, note) if note else out
+
+    def _run_command(self, comm, shell = False, cwd = None, timeout = None, group = False, sinks = None):
+        if selectors and ON_POSIX:
+            # Read the pipes ourselves so we can stop waiting on anything the
+            # command leaves holding them open if we have to stop it
+            return self._stream_select(comm, shell, cwd, timeout=timeout, group=group, tee=False, sinks=sinks)
+        if sinks:
+            return self._run_pumped(comm, shell, cwd, timeout=timeout, group=group, tee=False, sinks=sinks)
+        c = finished = None
         try:
             if shell and type(comm) is list:
                 comm = " ".join(shlex.quote(x) for x in comm)
             if not shell and type(comm) is str:
                 comm = shlex.split(comm)
-            p = subprocess.Popen(comm, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            p = subprocess.Popen(comm, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, **self._popen_args(group))
+            finished = self.stop_after(p, comm, timeout, group)
             c = p.communicate()
         except:
             if c == None:
+                if finished: finished()
                 return ("", "Command not found!", 1)
-        return (self._decode(c[0]), self._decode(c[1]), p.returncode)
+        out = (self._decode(c[0]), self._decode(c[1]), p.returncode)
+        note = finished()
+        return self._partial(out, note) if note else out
 
-    def run(self, command_list, leave_on_fail = False):
-        # Command list should be an array of dicts
-        if type(command_list) is dict:
-            # We only have one command
-            command_list = [command_list]
+    def _prepare(self, comm):
+        # Prints the command's message, and pulls out everything we need to run
+        # it - adding sudo if needed.  Returns None if there's nothing to run.
+        mess   = comm.get("message", None)
+        if not mess == None:
+            print(mess)
+        args   = comm.get("args",   [])
+        if not len(args):
+            # nothing to process
+            return None
+        stream = comm.get("stream", False)
+        sudo   = comm.get("sudo",   False)
+        cache  = comm.get("cache",  False)
+        # "timeout" is the number of seconds the command can run before it's
+        # stopped and its partial output returned - with a TIMED_OUT return code
+        timeout = comm.get("timeout", self.timeout)
+        # "stdout_to" and "stderr_to" send that output straight to a file object
+        # (i.e. an archive member) or descriptor instead of returning it - through
+        # "transform"/"stderr_transform" if passed.  A transform has feed(bytes)
+        # and flush() methods returning the bytes to write, like redact.Redact.
+        sinks  = {}
+        for fd, sink, transform in ((1, "stdout_to", "transform"), (2, "stderr_to", "stderr_transform")):
+            if comm.get(sink, None) is not None:
+                sinks[fd] = (comm[sink], comm.get(transform, None))
+        prep   = {
+            "args"      : args,
+            "shell"     : comm.get("shell",  False),
+            "stream"    : stream,
+            "stdout"    : comm.get("stdout", False),
+            "stderr"    : comm.get("stderr", False),
+            "cwd"       : comm.get("cwd",    None),
+            "invalidate": comm.get("invalidate", False),
+            # Only cache whitelisted commands we're not streaming or elevating.
+            # "cache" can be True to use our default ttl, or a number of seconds
+            "key"       : self._cache_key(args, comm.get("shell", False)) if cache and not (stream or sudo or sinks) else None,
+            "ttl"       : self.cache_ttl if cache is True else cache,
+            "timeout"   : timeout,
+            "sinks"     : sinks,
+            # Interactive commands share our terminal - and can only be stopped
+            # on their own.  "group" can be False for commands that elevate
+            # themselves (i.e. shell commands calling sudo).
+            "group"     : bool(timeout) and comm.get("group", not (stream or sudo))
+        }
+        if sudo:
+            # Check if we have sudo
+            out = self.run({"args":["which", "sudo"]})
+            if "sudo" in out[0]:
+                # Can sudo
+                if type(args) is list:
+                    prep["args"] = [out[0].replace("\n", "")] + args # add to start of list
+                elif type(args) is str:
+                    prep["args"] = out[0].replace("\n", "") + " " + args # add to start of string
+        if comm.get("show", False):
+            print(" ".join(prep["args"]))
+        return prep
+
+    def _get_prepared(self, prep):
+        # Returns the cached output for the prepared command, if any
+        return self._get_cached(prep["key"], prep["ttl"]) if prep["key"] else None
+
+    def _launch(self, prep):
+        # Actually runs the prepared command - returning its output
+        if prep["stream"]:
+            # Stream it!
+            return self._stream_output(prep["args"], prep["shell"], prep["cwd"], prep["timeout"], prep["group"], prep["sinks"])
+        # Just run and gather output
+        return self._run_command(prep["args"], prep["shell"], prep["cwd"], prep["timeout"], prep["group"], prep["sinks"])
+
+    def _execute(self, prep):
+        # Runs the prepared command and returns (output, was_cached) - using
+        # the cache if we can
+        if not prep["stream"]:
+            out = self._get_prepared(prep)
+            if out is not None:
+                return (out, True)
+        if _backend:
+            return (_backend.execute(self, prep), False)
+        return (self._launch(prep), False)
+
+    def _finish(self, prep, out, cached = False):
+        # Caches and prints the output of a finished command
+        if not prep["stream"]:
+            if prep["key"] and not cached and out[2] == 0:
+                self._set_cached(prep["key"], out)
+            if prep["stdout"] and len(out[0]):
+                print(out[0])
+            if prep["stderr"] and len(out[1]):
+                print(out[1])
+        if prep["invalidate"]:
+            # This command changed the system - drop anything cached
+            self.invalidate()
+
+    def _run_serial(self, command_list, leave_on_fail = False, keep_empty = False):
+        # keep_empty gives commands with nothing to run an EMPTY output, rather
+        # than leaving them out
         output_list = []
         for comm in command_list:
-            args   = comm.get("args",   [])
-            shell  = comm.get("shell",  False)
-            stream = comm.get("stream", False)
-            sudo   = comm.get("sudo",   False)
-            stdout = comm.get("stdout", False)
-            stderr = comm.get("stderr", False)
-            mess   = comm.get("message", None)
-            show   = comm.get("show",   False)
-            
-            if not mess == None:
-                print(mess)
-
-            if not len(args):
-                # nothing to process
+            prep = self._prepare(comm)
+            if prep is None:
+                if keep_empty:
+                    output_list.append(EMPTY)
                 continue
-            if sudo:
-                # Check if we have sudo
-                out = self._run_command(["which", "sudo"])
-                if "sudo" in out[0]:
-                    # Can sudo
-                    if type(args) is list:
-                        args.insert(0, out[0].replace("\n", "")) # add to start of list
-                    elif type(args) is str:
-                        args = out[0].replace("\n", "") + " " + args # add to start of string
-            
-            if show:
-                print(" ".join(args))
-
-            if stream:
-                # Stream it!
-                out = self._stream_output(args, shell)
-            else:
-                # Just run and gather output
-                out = self._run_command(args, shell)
-                if stdout and len(out[0]):
-                    print(out[0])
-                if stderr and len(out[1]):
-                    print(out[1])
+            out, cached = self._execute(prep)
+            self._finish(prep, out, cached)
             # Append output
             output_list.append(out)
             # Check for errors
             if leave_on_fail and out[2] != 0:
                 # Got an error - leave
                 break
+        return output_list
+
+    def _use_asyncio(self):
+        if not _load_asyncio():
+            return False
+        # Before 3.8 the default child watcher can only be used from the main
+        # thread - and collectors call us from the scheduler's workers
+        if ON_POSIX and sys.version_info < (3,8) and threading.current_thread() is not threading.main_thread():
+            return False
+        return True
+
+    def _spawn(self, loop, prep):
+        # Starts the prepared command on the loop - returning a future for its
+        # (stdout, stderr, returncode) that never raises
+        if prep["stream"] or prep["sinks"] or _backend:
+            # Streaming blocks on the terminal, sinks on whatever they write to,
+            # and the backend on whatever it does - so hand those off to a thread
+            return loop.run_in_executor(None, lambda: self._execute(prep)[0])
+        done  = loop.create_future()
+        comm, shell, cwd, timeout = prep["args"], prep["shell"], prep["cwd"], prep["timeout"]
+        entry = self._track(None, prep["group"], loop)
+        timer = []
+        def on_start(protocol):
+            entry["target"]  = protocol.transport
+            entry["abandon"] = protocol.finish
+            if timeout:
+                timer.append(loop.call_later(timeout, self._expire, entry, "Timed out after {}s".format(timeout)))
+        def on_done(o, e, returncode):
+            for t in timer:
+                t.cancel()
+            self._untrack(entry)
+            out = (self._decode(o), self._decode(e), returncode)
+            if entry["expired"]:
+                out = self._partial(out, self._note_stopped(comm, entry))
+            if not done.done():
+                done.set_result(out)
+        try:
+            if shell and type(comm) is list:
+                comm = " ".join(shlex.quote(x) for x in comm)
+            if not shell and type(comm) is str:
+                comm = shlex.split(comm)
+            factory = lambda: _CollectProtocol(on_start, on_done)
+            kwargs  = dict(stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, **self._popen_args(prep["group"]))
+            if shell:
+                coro = loop.subprocess_shell(factory, comm, **kwargs)
+            else:
+                coro = loop.subprocess_exec(factory, *comm, **kwargs)
+        except:
+            self._untrack(entry)
+            done.set_result(("", "Command not found!", 1))
+            return done
+        def spawned(f):
+            if (f.cancelled() or f.exception() is not None) and not done.done():
+                self._untrack(entry)
+                done.set_result(("", "Command not found!", 1))
+        loop.create_task(coro).add_done_callback(spawned)
+        return done
+
+    def _run_async(self, command_list, leave_on_fail = False, limit = 8):
+        # Starts commands in order as slots free up - keeping at most limit
+        # running at once.  Returns (prep, output, was_cached) per command -
+        # (None, EMPTY, False) for those with nothing to run, and None for those
+        # that were never started.
+        loop     = asyncio.new_event_loop()
+        results  = [None] * len(command_list)
+        state    = {"next":0, "running":0, "failed":False}
+        finished = loop.create_future()
+
+        def start_next():
+            while state["running"] < max(1, limit) and state["next"] < len(command_list) and not state["failed"]:
+                i = state["next"]
+                state["next"] += 1
+                prep = self._prepare(command_list[i])
+                if prep is None:
+                    results[i] = (None, EMPTY, False)
+                    continue
+                out = None if prep["stream"] else self._get_prepared(prep)
+                if out is not None:
+                    results[i] = (prep, out, True)
+                    continue
+                state["running"] += 1
+                self._spawn(loop, prep).add_done_callback(lambda f, i=i, prep=prep: done(i, prep, f))
+            if not state["running"] and not finished.done():
+                finished.set_result(None)
+
+        def done(i, prep, f):
+            state["running"] -= 1
+            out = f.result()
+            results[i] = (prep, out, False)
+            if leave_on_fail and out[2] != 0:
+                # Don't start anything else
+                state["failed"] = True
+            start_next()
+
+        try:
+            loop.call_soon(start_next)
+            loop.run_until_complete(finished)
+        finally:
+            loop.close()
+        return results
+
+    def run_many(self, command_list, leave_on_fail = False, limit = 8):
+        # Like run() - but runs the commands concurrently, at most limit at a
+        # time, and always returns a list of outputs in the same order as the
+        # commands - those with no args get EMPTY in their place.  With
+        # leave_on_fail nothing new is started once a command fails, and the
+        # outputs stop at the first failed command.
+        if type(command_list) is dict:
+            command_list = [command_list]
+        if not self._use_asyncio():
+            return self._run_serial(command_list, leave_on_fail, keep_empty=True)
+        output_list = []
+        for entry in self._run_async(command_list, leave_on_fail, limit):
+            if entry is None:
+                continue
+            prep, out, cached = entry
+            if prep is not None:
+                self._finish(prep, out, cached)
+            output_list.append(out)
+            if leave_on_fail and out[2] != 0:
+                break
+        return output_list
+
+    def run(self, command_list, leave_on_fail = False):
+        # Command list should be an array of dicts
+        if type(command_list) is dict:
+            # We only have one command
+            command_list = [command_list]
+        output_list = self._run_serial(command_list, leave_on_fail)
         if len(output_list) == 1:
             # We only ran one command - just return that output
             return output_list[0]
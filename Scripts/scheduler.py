@@ -0,0 +1,130 @@
+import threading, time
+try:
+    from Queue import Queue, Empty
+except:
+    from queue import Queue, Empty
+
+class Scheduler:
+
+    def __init__(self, max_workers = 4, timeout = None):
+        try: max_workers = int(max_workers)
+        except: max_workers = 4
+        self.max_workers = max(1, max_workers)
+        # Default number of seconds a task can run - None waits forever
+        self.timeout = timeout
+        self.tasks   = {}
+        self.order   = []
+        self.results = {}
+        self.errors  = {}
+        self.skipped = []
+        # Tasks we stopped waiting on - name -> timeout
+        self.timed_out = {}
+
+    def add(self, name, target, args = None, kwargs = None, depends = None, timeout = None, after = None):
+        # Registers a task to run - depends is a list of task names that must
+        # complete successfully before this one is started.  after is a list of
+        # task names that just have to be over (done, failed, skipped, or timed
+        # out) - for ordering without needing their results.  If the task runs
+        # longer than timeout seconds we stop waiting on it and carry on without
+        # it - threads can't be killed, so it's left to finish in the background.
+        if name in self.tasks:
+            raise ValueError("Task '{}' already exists".format(name))
+        self.tasks[name] = {
+            "target"  : target,
+            "args"    : args or (),
+            "kwargs"  : kwargs or {},
+            "depends" : list(depends or []),
+            "after"   : list(after or []),
+            "timeout" : self.timeout if timeout is None else timeout
+        }
+        self.order.append(name)
+
+    def result(self, name, default = None):
+        # Returns the result of a finished task - or default if it didn't run
+        return self.results.get(name, default)
+
+    def _check_tasks(self):
+        # Ensure all dependencies exist and that we don't have any cycles
+        for name in self.order:
+            for dep in self.tasks[name]["depends"] + self.tasks[name]["after"]:
+                if not dep in self.tasks:
+                    raise ValueError("Task '{}' depends on unknown task '{}'".format(name, dep))
+        resolved = []
+        remaining = list(self.order)
+        while remaining:
+            ready = [x for x in remaining if all(d in resolved for d in self.tasks[x]["depends"] + self.tasks[x]["after"])]
+            if not ready:
+                raise ValueError("Circular dependency between: {}".format(", ".join(remaining)))
+            for x in ready:
+                resolved.append(x)
+                remaining.remove(x)
+
+    def _run_task(self, name, finished):
+        task = self.tasks[name]
+        try:
+            result = task["target"](*task["args"], **task["kwargs"])
+            if not name in self.timed_out:
+                self.results[name] = result
+        except Exception as e:
+            if not name in self.timed_out:
+                self.errors[name] = e
+        finished.put(name)
+
+    def _next_finished(self, finished, deadlines):
+        # Waits for a running task to finish and returns its name - or None if
+        # one ran out of time first, which is then marked as timed out
+        if not deadlines:
+            return finished.get()
+        name = min(deadlines, key=deadlines.get)
+        try:
+            return finished.get(timeout=max(0, deadlines[name] - time.time()))
+        except Empty:
+            del deadlines[name]
+            self.timed_out[name] = self.tasks[name]["timeout"]
+            return None
+
+    def run(self):
+        # Runs all tasks on at most max_workers threads, starting each as soon as
+        # its dependencies have finished.  Tasks whose dependencies failed or timed
+        # out are skipped.
+        self._check_tasks()
+        pending   = list(self.order)
+        finished  = Queue()
+        done      = []
+        running   = 0
+        deadlines = {}
+        while pending or running:
+            for name in list(pending):
+                depends = self.tasks[name]["depends"]
+                if any(d in self.errors or d in self.skipped or d in self.timed_out for d in depends):
+                    # A dependency failed - we can't run this one
+                    pending.remove(name)
+                    self.skipped.append(name)
+                    continue
+                if running >= self.max_workers or not all(d in done for d in depends):
+                    continue
+                if not all(d in done or d in self.errors or d in self.skipped or d in self.timed_out for d in self.tasks[name]["after"]):
+                    continue
+                pending.remove(name)
+                t = threading.Thread(target=self._run_task, args=(name, finished))
+                t.daemon = True
+                t.start()
+                running += 1
+                if self.tasks[name]["timeout"]:
+                    deadlines[name] = time.time() + self.tasks[name]["timeout"]
+            if not running:
+                # Nothing left that can run - skip the rest
+                self.skipped.extend(pending)
+                break
+            name = self._next_finished(finished, deadlines)
+            if name in self.timed_out:
+                # Finished after we gave up on it - its slot is already free
+                continue
+            running -= 1
+            if name is None:
+                # Gave up on one - free up its slot
+                continue
+            deadlines.pop(name, None)
+            if not name in self.errors:
+                done.append(name)
+        return self.results
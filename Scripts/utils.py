@@ -11,14 +11,21 @@ class Utils:
 
     def __init__(self, name = "Python Script"):
         self.name = name
-        # Init our colors before we need to print anything
-        cwd = os.getcwd()
-        os.chdir(os.path.dirname(os.path.realpath(__file__)))
-        if os.path.exists("colors.json"):
-            self.colors_dict = json.load(open("colors.json"))
-        else:
-            self.colors_dict = {}
-        os.chdir(cwd)
+        # colors.json is only loaded the first time we print in color
+
+    def __getattr__(self, name):
+        # Fills in colors_dict the first time it's needed
+        if name != "colors_dict":
+            raise AttributeError(name)
+        colors_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "colors.json")
+        self.colors_dict = {}
+        if os.path.exists(colors_path):
+            try:
+                with open(colors_path) as f:
+                    self.colors_dict = json.load(f)
+            except:
+                pass
+        return self.colors_dict
 
     def check_admin(self):
         # Returns whether or not we're admin
@@ -0,0 +1,169 @@
+import os, sys, json, tempfile, threading, time, hashlib
+
+class VersionCache:
+
+    def __init__(self, name = "kext_versions.json", cache_dir = None):
+        # Persists bundle versions between runs, keyed on the Info.plist path and
+        # its (mtime, inode, size) - so only changed bundles need to be parsed again
+        self.cache_dir  = cache_dir or self.get_cache_dir()
+        self.cache_path = os.path.join(self.cache_dir, name)
+        self.format     = 1
+        self.entries    = None
+        self.touched    = set()
+        self.changed    = False
+        self.lock       = threading.Lock()
+
+    def get_cache_dir(self):
+        # ~/Library/Caches on macOS - falling back to the XDG cache dir elsewhere
+        if sys.platform == "darwin":
+            base = os.path.expanduser(os.path.join("~","Library","Caches"))
+        else:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~",".cache"))
+        return os.path.join(base, "CorpNewt", "EssentialsList")
+
+    def _stat_key(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        # st_mtime_ns is py3 only
+        mtime = getattr(st, "st_mtime_ns", None)
+        if mtime is None:
+            mtime = int(st.st_mtime * 1000000000)
+        return [mtime, st.st_ino, st.st_size]
+
+    def load(self):
+        # Loads the cache from disk - starting fresh if it's missing, broken, or
+        # from a different format
+        entries = {}
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+            if data.get("format") == self.format and isinstance(data.get("entries"), dict):
+                entries = data["entries"]
+        except:
+            pass
+        self.entries = entries
+        return entries
+
+    def lookup(self, path, loader):
+        # Returns the cached value for path if the file hasn't changed - otherwise
+        # calls loader(path) and caches the result
+        key = self._stat_key(path)
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            entry = self.entries.get(path)
+            self.touched.add(path)
+            if key and entry and entry[:3] == key:
+                return entry[3]
+        value = loader(path)
+        if key:
+            with self.lock:
+                self.entries[path] = key + [value]
+                self.changed = True
+        return value
+
+    def prune(self):
+        # Drops entries we didn't look up this run whose files no longer exist
+        with self.lock:
+            if self.entries is None:
+                return
+            for path in list(self.entries):
+                if path in self.touched or os.path.exists(path):
+                    continue
+                del self.entries[path]
+                self.changed = True
+
+    def save(self):
+        # Prunes, then atomically replaces the cache file by writing to a temp
+        # file next to it and renaming it over the top
+        self.prune()
+        with self.lock:
+            if not self.changed:
+                return True
+            try:
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self.cache_dir)
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        json.dump({"format":self.format,"entries":self.entries}, f)
+                    if hasattr(os, "replace"):
+                        os.replace(temp_path, self.cache_path)
+                    else:
+                        # Python 2 - rename is atomic on POSIX, but won't overwrite on Windows
+                        if os.name == "nt" and os.path.exists(self.cache_path):
+                            os.remove(self.cache_path)
+                        os.rename(temp_path, self.cache_path)
+                except:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+            except Exception:
+                return False
+            self.changed = False
+            return True
+
+class ContentCache(VersionCache):
+
+    def __init__(self, name = "content_versions.json", cache_dir = None, max_age = 30*24*60*60):
+        # Same as VersionCache, but keyed on a hash of the file's contents - so
+        # identical files at different paths (or on different ESPs) share an
+        # entry.  Entries unused for max_age seconds are pruned.
+        VersionCache.__init__(self, name, cache_dir)
+        self.max_age = max_age
+        # How stale an entry's last-used time can get before a hit rewrites
+        # the cache - so lookups that hit don't force a save every run
+        self.refresh = 24*60*60
+
+    def _hash(self, path, chunk_size = 1024*1024):
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def lookup(self, path, loader):
+        try:
+            key = self._hash(path)
+        except (IOError, OSError):
+            return loader(path)
+        return self.lookup_hash(key, lambda: loader(path))
+
+    def lookup_hash(self, key, loader):
+        # Same as lookup() for callers that already hashed the contents - calls
+        # loader() on a miss
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            entry = self.entries.get(key)
+            self.touched.add(key)
+            if entry:
+                # Keep track of when we last used it - only worth saving once
+                # it's old enough to matter to prune()
+                now = int(time.time())
+                if now - entry[0] >= self.refresh:
+                    entry[0] = now
+                    self.changed = True
+                return entry[1]
+        value = loader()
+        with self.lock:
+            self.entries[key] = [int(time.time()), value]
+            self.changed = True
+        return value
+
+    def prune(self):
+        # Drops entries we haven't used in max_age seconds
+        with self.lock:
+            if self.entries is None:
+                return
+            cutoff = time.time() - self.max_age
+            for key in list(self.entries):
+                if key in self.touched or self.entries[key][0] >= cutoff:
+                    continue
+                del self.entries[key]
+                self.changed = True